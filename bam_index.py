@@ -8,6 +8,7 @@ import shutil
 import argparse
 import subprocess
 import multiprocessing
+import biofx_profile
 
 version = '1.0.021921'
 nprocs = 12
@@ -32,14 +33,17 @@ def get_args():
         action='version',
         version = f'%(prog)s - v{version}'
     )
+    biofx_profile.add_argument(parser)
     return parser.parse_args()
 
 def usage():
     return 'USAGE: {} <bam_file(s)>\n'.format(os.path.basename(__file__))
     
+@biofx_profile.timed()
 def index_bam(bam):
     sys.stdout.write('Indexing {}...\n'.format(bam))
     sys.stdout.flush()
+    biofx_profile.count('records')
     try:
         subprocess.run(['samtools', 'index', bam], check=True)
     except KeyboardInterrupt:
@@ -53,6 +57,9 @@ def main(bam_files, procs):
     pool = multiprocessing.Pool(processes=procs)
     try:
         pool.map(index_bam, [bam for bam in bam_files])
+        # Let the workers exit cleanly, rather than being terminated at exit.
+        pool.close()
+        pool.join()
     except Exception:
         pool.close()
         pool.join()
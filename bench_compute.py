@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# Benchmark suite for the CPU bound code paths in the Python tools. Inputs are
+# generated from a seeded RNG so that runs are comparable, and results can be
+# saved as a JSON baseline and checked against later to catch regressions (and
+# to prove out speedups).
+################################################################################
+"""
+Benchmark the compute paths of the Python tools (codon / amino acid
+conversion, HGVSp conversion, pathway lookups, coordinate liftover, the batch
+file readers, CDS codon usage statistics, the SNV effect table and the six
+frame peptide search) on synthetic data. Save the results as a baseline with
+'--save', and compare against a baseline with '--baseline'; the run will exit
+non-zero if any benchmark's throughput drops by more than the threshold.
+"""
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from pprint import pprint as pp # noqa
+
+version = '1.0.101826'
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, script_dir)
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-b', '--bench',
+        metavar='<bench1,bench2,...>',
+        help='Comma separated list of benchmarks to run. Default: all of '
+            f"them ({','.join(benchmarks)})."
+    )
+    parser.add_argument(
+        '-s', '--scale',
+        type=float,
+        metavar='<float>',
+        default=1.0,
+        help='Multiplier for the number of synthetic inputs for each '
+            'benchmark. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        metavar='INT',
+        default=3,
+        help='Number of times to run each benchmark; the best run is kept. '
+            'Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        metavar='INT',
+        default=1,
+        help='Random seed for the input generators. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--baseline',
+        metavar='<json>',
+        help='Baseline JSON file to compare against.'
+    )
+    parser.add_argument(
+        '-t', '--threshold',
+        type=float,
+        metavar='<float>',
+        default=0.2,
+        help='Fraction of baseline throughput that a benchmark can drop '
+            'before it is called a regression. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--save',
+        metavar='<json>',
+        help='Save the results to this JSON file as a new baseline.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version=f'%(prog)s - v{version}'
+    )
+    args = parser.parse_args()
+
+    if args.bench:
+        args.bench = args.bench.split(',')
+        unknown = set(args.bench) - set(benchmarks)
+        if unknown:
+            sys.stderr.write(f"ERROR: Unknown benchmark(s): "
+                f"{','.join(unknown)}.\n")
+            sys.exit(1)
+    else:
+        args.bench = list(benchmarks)
+    return args
+
+# Synthetic data generators. All take a random.Random instance so that the
+# output only depends on the seed.
+def gen_codons(rng, n):
+    return [''.join(rng.choices('ACGT', k=3)) for _ in range(n)]
+
+def gen_amino_acids(rng, n, three=False):
+    import codon_aa_converter
+    pool = (codon_aa_converter.three_letter if three
+        else codon_aa_converter.single_letter)
+    return rng.choices(pool, k=n)
+
+def gen_hgvsp(rng, n):
+    aas = 'ACDEFGHIKLMNPQRSTVWY'
+    hgvs = []
+    for _ in range(n):
+        ref, alt = rng.choice(aas), rng.choice(aas + '*')
+        pos = rng.randint(1, 2000)
+        kind = rng.random()
+        if kind < 0.8:
+            hgvs.append(f'p.{ref}{pos}{alt}')
+        elif kind < 0.9:
+            hgvs.append(f'p.{ref}{pos}fs')
+        else:
+            hgvs.append(f'p.{ref}{pos}_{rng.choice(aas)}{pos + 3}del')
+    return hgvs
+
+def gen_genes(rng, n, pathway_data):
+    known = sorted({g for k, v in pathway_data.items() if k != 'file_info'
+        for g in v})
+    # Mix in some misses, as a real gene list would have.
+    return [rng.choice(known) if rng.random() < 0.7 else f'GENE{i}'
+        for i in range(n)]
+
+def gen_coords(rng, n):
+    import standin_server
+    chroms = list(standin_server.chrom_sizes.items())[:22]
+    coords = []
+    for _ in range(n):
+        chrom, size = rng.choice(chroms)
+        coords.append((chrom, rng.randint(1, size - 1)))
+    return coords
+
+def write_lines(path, lines):
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(lines) + '\n')
+    return path
+
+# Benchmarks. Each one takes the RNG, scale and a temp dir, and returns the
+# number of items processed per run, and a function that does one run.
+def bench_translate(rng, scale, tmpdir):
+    import codon_aa_converter
+    codons = gen_codons(rng, int(1000000 * scale))
+    translate = codon_aa_converter.translate
+    return len(codons), lambda: [translate(c, 'aa') for c in codons]
+
+def bench_translate_codon(rng, scale, tmpdir):
+    import codon_aa_converter
+    aas = gen_amino_acids(rng, int(500000 * scale))
+    translate = codon_aa_converter.translate
+    return len(aas), lambda: [translate(a, 'codon') for a in aas]
+
+def bench_convert_aa(rng, scale, tmpdir):
+    import codon_aa_converter
+    aas = (gen_amino_acids(rng, int(500000 * scale)) +
+        gen_amino_acids(rng, int(500000 * scale), three=True))
+    convert_aa = codon_aa_converter.convert_aa
+    return len(aas), lambda: [convert_aa(a) for a in aas]
+
+def bench_hgvsp(rng, scale, tmpdir):
+    import hgvsp_short2long
+    hgvs = gen_hgvsp(rng, int(100000 * scale))
+    convert = hgvsp_short2long.convert
+    return len(hgvs), lambda: [convert(h) for h in hgvs]
+
+def bench_pathway(rng, scale, tmpdir):
+    import get_pathway
+    data = get_pathway.parse_json(get_pathway.sys_json)
+    genes = gen_genes(rng, int(20000 * scale), data)
+    return len(genes), lambda: get_pathway.get_pathway_by_gene(data, genes)
+
+def bench_liftover(rng, scale, tmpdir):
+    import standin_server
+    from pyliftover import LiftOver
+
+    chain = os.path.join(tmpdir, 'hg18ToHg19.over.chain.gz')
+    with open(chain, 'wb') as fh:
+        fh.write(standin_server.make_chain('hg18', 'hg19'))
+    lo = LiftOver(chain)
+    coords = gen_coords(rng, int(200000 * scale))
+    return len(coords), lambda: [lo.convert_coordinate(c, p)
+        for c, p in coords]
+
+def bench_batch_readers(rng, scale, tmpdir):
+    n = int(1000000 * scale)
+    batch = write_lines(os.path.join(tmpdir, 'batch.txt'),
+        [f'ENSG{rng.randint(0, 10 ** 11):011d}' for _ in range(n)])
+
+    import biofx_batch
+
+    def run():
+        list(biofx_batch.read_batch(batch))
+        list(biofx_batch.read_batch(batch, dedupe=True))
+    return n * 2, run
+
+def bench_codon_stats(rng, scale, tmpdir):
+    import numpy # noqa
+    import codon_aa_converter
+
+    n = int(5000 * scale)
+    fasta = os.path.join(tmpdir, 'cds.fa')
+    with open(fasta, 'w') as fh:
+        for i in range(n):
+            seq = 'ATG' + ''.join(gen_codons(rng, rng.randint(100, 600)))
+            fh.write(f'>CDS{i}\n{seq}TAA\n')
+    return n, lambda: codon_aa_converter.codon_counts(fasta, procs=1)
+
+def bench_snv_effects(rng, scale, tmpdir):
+    import numpy # noqa
+    import snv_effects
+
+    seqs = ['ATG' + ''.join(gen_codons(rng, rng.randint(100, 600))) + 'TAA'
+        for _ in range(int(500 * scale))]
+    mutator = snv_effects.Mutator()
+    n = sum(len(seq) * 3 for seq in seqs)
+    return n, lambda: [mutator.mutate_text(f'CDS{i}', seq, '\t')
+        for i, seq in enumerate(seqs)]
+
+def bench_peptide_search(rng, scale, tmpdir):
+    import numpy # noqa
+    import peptide_search
+
+    aas = 'ACDEFGHIKLMNPQRSTVWY'
+    peptides = [''.join(rng.choices(aas, k=9)) for _ in range(2000)]
+    peptides += ['SIINF[EK]KL', 'K.{2}EL']
+    seq = ''.join(rng.choices('ACGT', k=int(2000000 * scale)))
+    peptide_search._init_worker(peptides)
+    return len(seq), lambda: peptide_search._search_chunk(('chr1', 0, seq,
+        len(seq)))
+
+benchmarks = {
+    'translate'       : bench_translate,
+    'translate_codon' : bench_translate_codon,
+    'convert_aa'      : bench_convert_aa,
+    'hgvsp_convert'   : bench_hgvsp,
+    'pathway_by_gene' : bench_pathway,
+    'liftover'        : bench_liftover,
+    'batch_readers'   : bench_batch_readers,
+    'codon_stats'     : bench_codon_stats,
+    'snv_effects'     : bench_snv_effects,
+    'peptide_search'  : bench_peptide_search,
+}
+
+def run_benchmark(name, seed, scale, repeat):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            n, func = benchmarks[name](rng, scale, tmpdir)
+        except ImportError as error:
+            sys.stderr.write(f'WARN: Skipping {name} ({error}).\n')
+            return None
+
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+    best = min(times)
+    return {
+        'items'       : n,
+        'best_s'      : round(best, 4),
+        'items_per_s' : round(n / best, 1),
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results to a baseline and return a list of (name, ratio,
+    regressed) for each benchmark in both.
+    """
+    comparison = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base or not res:
+            continue
+        ratio = res['items_per_s'] / base['items_per_s']
+        comparison.append((name, ratio, ratio < 1 - threshold))
+    return comparison
+
+def print_results(results, comparison, outfh):
+    ratios = {name : (ratio, regressed) for name, ratio, regressed in
+        comparison}
+    outfh.write('\t'.join(('benchmark', 'items', 'best_s', 'items_per_s',
+        'vs_baseline')) + '\n')
+    for name, res in results.items():
+        if res is None:
+            outfh.write(f'{name}\t-\t-\t-\tskipped\n')
+            continue
+        vs = '-'
+        if name in ratios:
+            ratio, regressed = ratios[name]
+            vs = f'{ratio:.2f}x' + (' REGRESSION' if regressed else '')
+        outfh.write(f"{name}\t{res['items']}\t{res['best_s']}\t"
+            f"{res['items_per_s']}\t{vs}\n")
+
+def main(args):
+    results = {}
+    for name in args.bench:
+        sys.stderr.write(f'Running {name}...\n')
+        results[name] = run_benchmark(name, args.seed, args.scale, args.repeat)
+
+    comparison = []
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline['scale'] != args.scale or baseline['seed'] != args.seed:
+            sys.stderr.write('WARN: Baseline was run with a different scale or '
+                'seed; the comparison may not be meaningful.\n')
+        comparison = compare(results, baseline['results'], args.threshold)
+
+    print_results(results, comparison, sys.stdout)
+
+    if args.save:
+        sys.stderr.write(f"Writing baseline to '{args.save}'.\n")
+        with open(args.save, 'w') as fh:
+            json.dump({
+                'version' : version,
+                'date'    : time.strftime('%Y.%m.%d'),
+                'python'  : sys.version.split()[0],
+                'scale'   : args.scale,
+                'seed'    : args.seed,
+                'results' : results,
+            }, fh, indent=4)
+
+    regressions = [name for name, ratio, regressed in comparison if regressed]
+    if regressions:
+        sys.stderr.write(f"ERROR: Throughput regressed by more than "
+            f"{args.threshold:.0%} for: {', '.join(regressions)}.\n")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        sys.exit(main(args))
+    except KeyboardInterrupt:
+        sys.exit(9)
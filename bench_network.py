@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# Benchmark harness for the network bound tools. Each tool is run against the
+# local stand in server (standin_server.py) at a few batch sizes, so that the
+# effects of concurrency and caching changes can be measured offline and
+# reproducibly.
+################################################################################
+"""
+Run db2db_api.py, get_clinvar_variant_data.py, protein_domain_retrieve.py and
+map_refs.py against a local stand in server at several batch sizes, and report
+wall time, requests / sec, and p50 / p99 client side latency for each run.
+Latency is taken from the tools' own profile spans around each API call, so it
+includes any rate limiting, retries and queueing in the client; errors and
+throttled (429) responses are counted by the server and reported separately.
+"""
+import sys
+import os
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+from pprint import pprint as pp # noqa
+
+import standin_server
+
+version = '1.1.101826'
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-t', '--tools',
+        metavar='<tool1,tool2,...>',
+        default='db2db,clinvar,protein_domain,map_refs',
+        help='Comma separated list of tools to benchmark. Default: '
+            '%(default)s.'
+    )
+    parser.add_argument(
+        '-b', '--batch-sizes',
+        metavar='<n1,n2,...>',
+        default='1,10,100',
+        help='Comma separated list of batch sizes to run. Default: '
+            '%(default)s.'
+    )
+    parser.add_argument(
+        '-u', '--url',
+        metavar='<url>',
+        help='Use an already running stand in server at this URL rather than '
+            'starting one.'
+    )
+    parser.add_argument(
+        '-l', '--latency',
+        type=float,
+        metavar='<ms>',
+        default=50.0,
+        help='Stand in server latency. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-j', '--jitter',
+        type=float,
+        metavar='<ms>',
+        default=10.0,
+        help='Stand in server latency jitter. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-e', '--error-rate',
+        type=float,
+        metavar='<float>',
+        default=0.0,
+        help='Stand in server error rate. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-r', '--rate-limit',
+        type=float,
+        metavar='<req/s>',
+        default=0,
+        help='Stand in server rate limit. Default: %(default)s (no limit).'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<json_file>',
+        help='Write the results to a JSON file as well.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version=f'%(prog)s - v{version}'
+    )
+    args = parser.parse_args()
+
+    args.tools = args.tools.split(',')
+    unknown = set(args.tools) - set(tools)
+    if unknown:
+        sys.stderr.write(f"ERROR: Unknown tool(s): {','.join(unknown)}. "
+            f"Choose from {','.join(tools)}.\n")
+        sys.exit(1)
+    args.batch_sizes = [int(x) for x in args.batch_sizes.split(',')]
+    return args
+
+def write_batch(path, queries):
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(queries) + '\n')
+    return path
+
+# Each of these returns the command line to run, and any request latencies
+# (in seconds) measured by the harness itself.
+def db2db_cmd(url, tmpdir, n):
+    queries = [f'ENSG{i:011d}' for i in range(n)]
+    batch = write_batch(os.path.join(tmpdir, 'ensembl.txt'), queries)
+    return ['db2db_api.py', '-f', batch, '-o', os.devnull], []
+
+def clinvar_cmd(url, tmpdir, n):
+    queries = [str(13961 + i) for i in range(n)]
+    batch = write_batch(os.path.join(tmpdir, 'clinvar.txt'), queries)
+    return ['get_clinvar_variant_data.py', '-b', batch, '-o', os.devnull], []
+
+def protein_domain_cmd(url, tmpdir, n):
+    queries = [f'GENE{i}' for i in range(n)]
+    batch = write_batch(os.path.join(tmpdir, 'genes.txt'), queries)
+    return ['protein_domain_retrieve.py', 'build', '-f', batch, '-o',
+        os.path.join(tmpdir, 'domains.json')], []
+
+def map_refs_cmd(url, tmpdir, n):
+    # pyliftover would download the chain from UCSC; get it from the stand in
+    # instead, which counts as the one request for the run.
+    chain = os.path.join(tmpdir, 'hg18ToHg19.over.chain.gz')
+    start = time.perf_counter()
+    urllib.request.urlretrieve(
+        f'{url}/goldenPath/hg18/liftOver/hg18ToHg19.over.chain.gz', chain)
+    latency = time.perf_counter() - start
+    chroms = list(standin_server.chrom_sizes)
+    queries = [f'{chroms[i % 22]}:{1000000 + i * 1000}' for i in range(n)]
+    batch = write_batch(os.path.join(tmpdir, 'coords.txt'), queries)
+    return ['map_refs.py', '-c', chain, '-f', batch, '-o', os.devnull], [latency]
+
+# Command line function, and the profile spans that time each API call.
+tools = {
+    'db2db'          : (db2db_cmd, ['db2db_api.api_call']),
+    'clinvar'        : (clinvar_cmd, ['get_clinvar_variant_data.api_call']),
+    'protein_domain' : (protein_domain_cmd,
+                        ['protein_domain_retrieve.api_call']),
+    'map_refs'       : (map_refs_cmd, []),
+}
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[k]
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+def span_latencies(trace_file, names):
+    """
+    Durations (in seconds) of the named spans in a profile trace file.
+    """
+    try:
+        with open(trace_file) as fh:
+            events = json.load(fh)['traceEvents']
+    except (OSError, ValueError):
+        return []
+    return [e['dur'] / 1e6 for e in events if e['ph'] == 'X' and
+        e['name'] in names]
+
+def run_tool(tool, n, url):
+    env = dict(os.environ,
+        BIOFX_BIODBNET_URL=f'{url}/webServices/rest.php/biodbnetRestApi.json',
+        BIOFX_EUTILS_URL=f'{url}/entrez/eutils',
+        BIOFX_EBI_URL=f'{url}/proteins/api/features',
+    )
+    cmd_func, spans = tools[tool]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        trace = os.path.join(tmpdir, 'trace.json')
+        env['BIOFX_PROFILE'] = trace
+        get_json(f'{url}/_reset')
+        cmd, latencies = cmd_func(url, tmpdir, n)
+        cmd = [sys.executable, os.path.join(script_dir, cmd[0])] + cmd[1:]
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        wall = time.perf_counter() - start
+        stats = get_json(f'{url}/_stats')
+        latencies += span_latencies(trace, spans)
+
+    if proc.returncode != 0:
+        sys.stderr.write(f'WARN: {tool} failed with batch size {n}:\n')
+        lines = [line for line in proc.stderr.strip().split('\n')
+            if not line.startswith('Wrote profile trace')]
+        sys.stderr.write((lines or [''])[-1] + '\n')
+
+    return {
+        'tool'       : tool,
+        'batch_size' : n,
+        'ok'         : proc.returncode == 0,
+        'wall_s'     : round(wall, 4),
+        'requests'   : stats['requests'],
+        'req_per_s'  : round(stats['requests'] / wall, 2),
+        'calls'      : len(latencies),
+        'p50_ms'     : round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms'     : round(percentile(latencies, 99) * 1000, 2),
+        'errors'     : stats['errors'],
+        'throttled'  : stats['throttled'],
+    }
+
+def print_results(results, outfh):
+    header = ('tool', 'batch_size', 'ok', 'wall_s', 'requests', 'req_per_s',
+        'calls', 'p50_ms', 'p99_ms', 'errors', 'throttled')
+    outfh.write('\t'.join(header) + '\n')
+    for r in results:
+        outfh.write('\t'.join(str(r[h]) for h in header) + '\n')
+
+def main(args):
+    server = None
+    url = args.url
+    if url is None:
+        server = standin_server.start_server(latency=args.latency,
+            jitter=args.jitter, error_rate=args.error_rate,
+            rate_limit=args.rate_limit, seed=1)
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        sys.stderr.write(f'Started stand in server on {url}.\n')
+    url = url.rstrip('/')
+
+    results = []
+    try:
+        for tool in args.tools:
+            for n in args.batch_sizes:
+                sys.stderr.write(f'Running {tool} with batch size {n}...\n')
+                results.append(run_tool(tool, n, url))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print_results(results, sys.stdout)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({
+                'version'  : version,
+                'date'     : time.strftime('%Y.%m.%d'),
+                'settings' : {
+                    'latency'    : args.latency,
+                    'jitter'     : args.jitter,
+                    'error_rate' : args.error_rate,
+                    'rate_limit' : args.rate_limit,
+                },
+                'results'  : results,
+            }, fh, indent=4)
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# Single entry point for the quick lookup tools in this repo. Each of the
+# stand alone scripts pays for interpreter startup, imports and resource parsing
+# on every call, which adds up quickly when a pipeline calls them tens of
+# thousands of times. Here, the heavy imports are deferred until a subcommand
+# needs them, and an optional server can be started to keep the parsed
+# resources, LiftOver chains, etc. resident. When the server is running, the
+# CLI just forwards the command line to it.
+################################################################################
+"""
+Run one of the biofx lookup tools, either directly or through a running biofx
+server. Start the server with 'biofx.py server start' and any other calls will
+be forwarded to it automatically.
+
+Commands:
+    pathway   Get pathway(s) for a gene, or the genes in a pathway.
+    liftover  Map coordinates between reference assemblies.
+    codon     Convert between codons and amino acids.
+    gene      Get the gene at a GRCh37 'chr:pos' coordinate.
+    server    Start, stop or check the status of the biofx server.
+"""
+import sys
+import os
+import json
+import socket
+
+version = '1.0.101826'
+script_dir = os.path.dirname(os.path.realpath(__file__))
+# Keep the socket somewhere only this user can write to, so that no one else
+# can stand up a server to answer our queries.
+default_socket = os.environ.get(
+    'BIOFX_SOCKET',
+    os.path.join(os.environ.get('XDG_RUNTIME_DIR') or
+        os.path.join('/tmp', f'biofx-{os.getuid()}'), 'biofx.sock')
+)
+gene_file = os.path.join(script_dir, 'resources', 'gene_coordinates.txt')
+
+# Resources that we have already loaded, keyed by what was loaded.  In server
+# mode, these stay resident between requests.
+_resources = {}
+
+def get_resource(key, loader, stamp=None):
+    """
+    Return the cached resource for `key`, loading it if it isn't cached yet or
+    if its `stamp` (e.g. the file's mtime) has changed since it was loaded.
+    """
+    cached = _resources.get(key)
+    if cached is None or cached[0] != stamp:
+        cached = _resources[key] = (stamp, loader())
+    return cached[1]
+
+def file_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def get_parser():
+    import argparse
+    import biofx_profile
+
+    parser = argparse.ArgumentParser(
+        prog='biofx.py',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        '--socket',
+        metavar='<path>',
+        default=default_socket,
+        help='Path to the biofx server socket. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--local',
+        action='store_true',
+        help='Always run in this process, even if a server is running.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version=f'%(prog)s - v{version}'
+    )
+    biofx_profile.add_argument(parser)
+    subparsers = parser.add_subparsers(dest='command', metavar='<command>')
+
+    pathway = subparsers.add_parser('pathway', help='Get pathway(s) for a '
+        'gene, or the genes in a pathway.')
+    pathway.add_argument('gene', nargs='?', metavar='<gene1,gene2,...>',
+        help='Gene or comma separated list of genes to look up.')
+    pathway.add_argument('-b', '--batchfile', metavar='<batchfile>',
+        help='File containing a list of genes (one per line) to look up.')
+    pathway.add_argument('-p', '--pathway', metavar='<pathway>',
+        help="Pathway to search and return all genes. Use '?' to list them.")
+    pathway.add_argument('-j', '--json', metavar='<JSON>',
+        default=os.path.join(script_dir, 'resources', 'pathways.json'),
+        help='JSON file containing gene / pathway mapping info. Default: '
+        '%(default)s.')
+
+    liftover = subparsers.add_parser('liftover', help='Map coordinates '
+        'between reference assemblies.')
+    liftover.add_argument('coord', nargs='?', metavar='<chr:pos,...>',
+        help='Coordinate or comma separated list of coordinates to map.')
+    liftover.add_argument('-f', '--file', metavar='<batchfile>',
+        help='Batch file of coords to process.')
+    liftover.add_argument('-m', '--mapping', metavar='<query:result>',
+        default='hg18:hg19', help='Mapping of original coord to desired '
+        'coord. Default: %(default)s.')
+    liftover.add_argument('-c', '--chain', metavar='<chain_file>',
+        help='Chain file from UCSC for local mapping.')
+
+    codon = subparsers.add_parser('codon', help='Convert between codons and '
+        'amino acids.')
+    codon.add_argument('query', metavar='<codon | amino_acid>',
+        help='Codon or amino acid, or comma separated list of them, to '
+        'convert.')
+
+    gene = subparsers.add_parser('gene', help="Get the gene at a GRCh37 "
+        "'chr:pos' coordinate.")
+    gene.add_argument('coord', nargs='?', metavar='<chr:pos,...>',
+        help='Coordinate or comma separated list of coordinates to look up.')
+    gene.add_argument('-b', '--batchfile', metavar='<batchfile>',
+        help='File of coordinates, one per line, to look up.')
+
+    server = subparsers.add_parser('server', help='Start, stop or check the '
+        'status of the biofx server.')
+    server.add_argument('action', choices=('start', 'stop', 'status'),
+        help='Server action.')
+    server.add_argument('-d', '--daemon', action='store_true',
+        help='Run the server in the background.')
+
+    # Take '--profile' after the command as well as before it.
+    for subparser in subparsers.choices.values():
+        biofx_profile.add_argument(subparser, default=argparse.SUPPRESS)
+    return parser
+
+def run_pathway(args):
+    import biofx_batch
+    import biofx_output
+    import get_pathway
+
+    # The server changes to the client's directory for each request, so key
+    # on the absolute path.
+    json_file = os.path.abspath(args.json)
+    data = get_resource(('pathway', json_file),
+        lambda: get_pathway.parse_json(json_file), file_stamp(json_file))
+    if args.pathway:
+        results = get_pathway.get_gene_by_pathway(data, args.pathway)
+    else:
+        if args.batchfile:
+            genes = biofx_batch.read_batch(args.batchfile, dedupe=True)
+        elif args.gene:
+            genes = args.gene.split(',')
+        else:
+            sys.stderr.write('ERROR: You must input either a gene or pathway '
+                'to query!\n')
+            return 1
+        results = get_pathway.get_pathway_by_gene(data, genes)
+    with biofx_output.open_writer(None, delimiter=',') as writer:
+        get_pathway.print_results(results, writer)
+    return 0
+
+def run_liftover(args):
+    import map_refs
+    import biofx_batch
+
+    if args.file:
+        coords = biofx_batch.read_batch(args.file)
+    elif args.coord:
+        coords = args.coord.split(',')
+    else:
+        sys.stderr.write("ERROR: You must input either a list of coords to "
+            "check or a batch file containing a set of coords.\n")
+        return 1
+
+    orig_assembly, new_assembly = args.mapping.split(':')
+    if args.chain:
+        chain = os.path.abspath(args.chain)
+        key = ('liftover', chain)
+        loader = lambda: map_refs.LiftOver(chain)
+        stamp = file_stamp(chain)
+    else:
+        key = ('liftover', orig_assembly, new_assembly)
+        loader = lambda: map_refs.LiftOver(orig_assembly, new_assembly)
+        stamp = None
+    lo = get_resource(key, loader, stamp)
+
+    results = []
+    for coord in coords:
+        chrom, pos = coord.split(':')
+        mapped = lo.convert_coordinate(chrom, int(pos))
+        if not mapped:
+            sys.stderr.write(f'WARN: Can not map coord {coord}.\n')
+            continue
+        results.append((chrom, pos,) + tuple(mapped[0]))
+    map_refs.print_results(results, None)
+    return 0
+
+def load_gene_index(gene_file):
+    """
+    Read the gene coordinates file into a per chromosome interval index of
+    sorted starts, running max of the ends, and the gene records, leaving out
+    the MiRs just as get_gene_by_coord.pl does.
+    """
+    genes = {}
+    with open(gene_file) as fh:
+        for line in fh:
+            chrom, start, end, gene, strand = line.rstrip('\n').split('\t')
+            if gene.startswith('MIR'):
+                continue
+            genes.setdefault(chrom, []).append((int(start), int(end), gene))
+
+    index = {}
+    for chrom, records in genes.items():
+        records.sort()
+        max_ends = []
+        running = 0
+        for rec in records:
+            running = max(running, rec[1])
+            max_ends.append(running)
+        index[chrom] = ([r[0] for r in records], max_ends, records)
+    return index
+
+def map_gene(index, coord, pad=150):
+    from bisect import bisect_right
+
+    chrom, pos = coord.split(':')
+    pos = int(pos)
+    try:
+        starts, max_ends, records = index[chrom]
+    except KeyError:
+        return None
+
+    # Pad the start and stop to account for upstream and downstream
+    # regulatory variants that might pop up. Return the first gene by start.
+    i = bisect_right(starts, pos + pad - 1) - 1
+    hit = None
+    while i >= 0 and max_ends[i] + pad > pos:
+        if records[i][1] + pad > pos:
+            hit = records[i][2]
+        i -= 1
+    return hit
+
+def run_gene(args):
+    import biofx_batch
+
+    if args.batchfile:
+        coords = biofx_batch.read_batch(args.batchfile)
+    elif args.coord:
+        coords = args.coord.split(',')
+    else:
+        sys.stderr.write('ERROR: Not enough arguments passed to script!\n')
+        return 1
+
+    index = get_resource(('gene', gene_file),
+        lambda: load_gene_index(gene_file), file_stamp(gene_file))
+    missing = []
+    for coord in coords:
+        gene = map_gene(index, coord)
+        if gene is None:
+            missing.append(coord)
+        else:
+            sys.stdout.write(f'{coord},{gene}\n')
+
+    if missing:
+        sys.stderr.write('WARNING: The following coordinates did not map to a '
+            'gene: \n')
+        for coord in missing:
+            sys.stderr.write(f'\t{coord}\n')
+    return 0
+
+def run_codon(args):
+    import codon_aa_converter
+
+    codon_aa_converter.main(args.query)
+    return 0
+
+commands = {
+    'pathway'  : run_pathway,
+    'liftover' : run_liftover,
+    'codon'    : run_codon,
+    'gene'     : run_gene,
+}
+
+def run_local(argv):
+    """
+    Parse and run a command line in this process, returning the exit code.
+    """
+    parser = get_resource(('parser',), get_parser)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 1
+    if args.command == 'server':
+        return run_server(args)
+    import biofx_profile
+    if args.profile and not biofx_profile.enabled():
+        biofx_profile.enable(args.profile)
+    with biofx_profile.span(f'biofx.{args.command}'):
+        return commands[args.command](args)
+
+def run_captured(argv, cwd):
+    """
+    Run a command line for a client, capturing its output, and return a dict
+    of the exit code, stdout and stderr.
+    """
+    from io import StringIO
+    from contextlib import redirect_stdout, redirect_stderr
+
+    out, err = StringIO(), StringIO()
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            os.chdir(cwd)
+            code = run_local(argv)
+        except SystemExit as exit:
+            # Same as the interpreter: no code is success, and any other
+            # non-int code is printed and is a failure.
+            if exit.code is None:
+                code = 0
+            elif isinstance(exit.code, int):
+                code = exit.code
+            else:
+                sys.stderr.write(f'{exit.code}\n')
+                code = 1
+        except Exception as error:
+            sys.stderr.write(f'ERROR: {error!r}\n')
+            code = 1
+    return {'code' : code, 'out' : out.getvalue(), 'err' : err.getvalue()}
+
+def _send(sock_path, message):
+    # Only talk to a server run by this user.
+    if os.stat(sock_path).st_uid != os.getuid():
+        raise PermissionError(f'{sock_path} is not owned by this user')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(sock_path)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
+
+def query(argv, sock_path=default_socket):
+    """
+    Send a command line to a running server, and return a dict of the exit
+    code, stdout and stderr. Raises OSError if no server is running.
+    """
+    return _send(sock_path, {'argv' : list(argv), 'cwd' : os.getcwd()})
+
+def run_server(args):
+    if args.action == 'status':
+        try:
+            reply = _send(args.socket, {'status' : True})
+        except PermissionError as error:
+            sys.stdout.write(f'Not using the biofx server: {error}.\n')
+            return 1
+        except OSError:
+            sys.stdout.write(f'No biofx server running on {args.socket}.\n')
+            return 1
+        sys.stdout.write(f"biofx server v{reply['version']} (pid "
+            f"{reply['pid']}) running on {args.socket}.\n")
+        return 0
+
+    if args.action == 'stop':
+        try:
+            _send(args.socket, {'stop' : True})
+        except OSError:
+            sys.stderr.write(f'No biofx server running on {args.socket}.\n')
+            return 1
+        sys.stderr.write('Stopped biofx server.\n')
+        return 0
+
+    import socketserver
+    import threading
+
+    sock_dir = os.path.dirname(os.path.abspath(args.socket))
+    if args.socket == default_socket:
+        os.makedirs(sock_dir, mode=0o700, exist_ok=True)
+        st = os.stat(sock_dir)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            sys.stderr.write(f'ERROR: {sock_dir} must be owned by you, and '
+                'not accessible to anyone else.\n')
+            return 1
+
+    if os.path.exists(args.socket):
+        try:
+            _send(args.socket, {'status' : True})
+            sys.stderr.write(f'ERROR: A biofx server is already running on '
+                f'{args.socket}.\n')
+            return 1
+        except PermissionError as error:
+            sys.stderr.write(f'ERROR: {error}.\n')
+            return 1
+        except OSError:
+            # Stale socket from a server that did not exit cleanly.
+            os.unlink(args.socket)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            message = json.loads(self.rfile.readline())
+            if message.get('status'):
+                reply = {'version' : version, 'pid' : os.getpid()}
+            elif message.get('stop'):
+                reply = {}
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                reply = run_captured(message['argv'], message['cwd'])
+            self.wfile.write(json.dumps(reply).encode())
+
+    if args.daemon:
+        if os.fork():
+            sys.stderr.write(f'Started biofx server on {args.socket}.\n')
+            return 0
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+
+    # Requests are handled one at a time, since the commands write to the
+    # process wide stdout and stderr.
+    # Create the socket with only owner access from the start.
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(args.socket, Handler)
+    finally:
+        os.umask(umask)
+    if not args.daemon:
+        sys.stderr.write(f'biofx server listening on {args.socket}.\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+    return 0
+
+def _client_only(arg):
+    # STDIN, and the /dev/fd paths that process substitution uses, can only be
+    # read by this process, not by the server.
+    value = arg.split('=', 1)[-1]
+    return value == '-' or value.startswith(('/dev/stdin', '/dev/fd/',
+        '/proc/self/fd/'))
+
+def _socket_arg(argv):
+    # The --socket value, as '--socket <path>' or '--socket=<path>'. None if
+    # it is missing its path, so that argparse can report that.
+    sock_path = default_socket
+    for i, arg in enumerate(argv):
+        if arg == '--socket':
+            sock_path = argv[i + 1] if i + 1 < len(argv) else None
+        elif arg.startswith('--socket='):
+            sock_path = arg.split('=', 1)[1]
+    return sock_path
+
+def main(argv):
+    # Look for the server before doing anything else, so that forwarded calls
+    # don't pay for argparse or any of the tool imports.
+    sock_path = _socket_arg(argv)
+    # Profiled calls run locally, so that the trace is of this call.
+    forward = (
+        argv
+        and not {'server', '--local', '-h', '--help', '-v', '--version',
+            '--profile'} & {arg.split('=', 1)[0] for arg in argv}
+        and not any(_client_only(arg) for arg in argv)
+        and sock_path
+        and os.path.exists(sock_path)
+    )
+    if forward:
+        try:
+            reply = query(argv, sock_path)
+        except PermissionError as error:
+            sys.stderr.write(f'WARN: Not using the biofx server: {error}.\n')
+        except OSError:
+            pass
+        else:
+            sys.stdout.write(reply['out'])
+            sys.stderr.write(reply['err'])
+            return reply['code']
+    return run_local(argv)
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except KeyboardInterrupt:
+        sys.exit(9)
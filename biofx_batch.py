@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Shared batch file reader for the Python tools in this repo.
+################################################################################
+"""
+Stream queries from a batch file, one per line. The batch file can be plain
+text, gzip / bgzip compressed, or '-' to read from STDIN. Blank lines and
+comment lines are skipped, and duplicate queries can be dropped (keeping the
+first one seen) so that they don't turn into wasted lookups or API calls.
+"""
+import sys
+import io
+import gzip
+
+from collections import deque
+from contextlib import nullcontext
+from itertools import islice
+
+class _GzipReader(gzip.GzipFile):
+    """
+    GzipFile that also closes the file object it reads from.
+    """
+    def __init__(self, fh):
+        super().__init__(fileobj=fh, mode='rb')
+        self._fh = fh
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._fh.close()
+
+def open_input(path):
+    """
+    Open a batch file for reading as text, handling '-' for STDIN and gzip or
+    bgzip compressed files. The file is only opened once, and sniffed with a
+    peek at the buffer, so that pipes, FIFOs and process substitution work.
+    """
+    if path == '-':
+        return nullcontext(sys.stdin)
+    fh = open(path, 'rb')
+    if path.endswith(('.gz', '.bgz')) or fh.peek(2)[:2] == b'\x1f\x8b':
+        return io.TextIOWrapper(_GzipReader(fh))
+    return io.TextIOWrapper(fh)
+
+def read_batch(path, comment='#', dedupe=False):
+    """
+    Generator that yields each query in a batch file, with surrounding
+    whitespace removed, skipping blank lines and lines starting with
+    `comment`. If `dedupe` is set, only the first instance of each query is
+    yielded.
+    """
+    seen = set()
+    with open_input(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or (comment and line.startswith(comment)):
+                continue
+            if dedupe:
+                if line in seen:
+                    continue
+                seen.add(line)
+            yield line
+
+def chunked(iterable, size):
+    """
+    Generator that yields lists of up to `size` items from `iterable`, for
+    consumers that want to batch up queries.
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def pool_map(func, items, procs=4, initializer=None, initargs=(), backlog=2):
+    """
+    Generator that yields `func(item)` for each item, in order, running them
+    across a pool of `procs` processes. Only `backlog` items per process are
+    in flight at once, so that results don't pile up in memory ahead of a
+    slower consumer. With `procs` of 1 or less, runs in this process.
+    """
+    if procs <= 1:
+        if initializer:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes=procs, initializer=initializer,
+        initargs=initargs)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= procs * backlog:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        # Let the workers exit cleanly, so that their exit handlers (like
+        # writing the biofx_profile part files) get to run.
+        pool.close()
+    except BaseException:
+        # An error, or the caller stopped early; drop the rest of the work.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# Shared tabular output writers for the Python tools in this repo.
+################################################################################
+"""
+Write tabular results as delimited text (optionally gzip or zstd compressed),
+or as Parquet / Arrow IPC when pyarrow is installed. The format comes from the
+output file name:
+
+    out.tsv, out.txt          Tab delimited text.
+    out.csv                   Comma delimited text.
+    out.tsv.gz, out.csv.gz    gzip compressed text.
+    out.tsv.zst, out.csv.zst  zstd compressed text (needs zstandard or
+                              Python 3.14+).
+    out.parquet               Parquet (needs pyarrow).
+    out.arrow, out.feather    Arrow IPC file (needs pyarrow).
+
+If a compression library or pyarrow is not available, we fall back to gzip
+compressed text and say so. With no output file, text goes to STDOUT.
+"""
+import sys
+import os
+import csv
+
+text_buffer = 1 << 20
+arrow_batch = 65536
+
+def _strip_compression(path):
+    for ext in ('.gz', '.bgz', '.zst'):
+        if path.endswith(ext):
+            return path[:-len(ext)], ext
+    return path, None
+
+def _open_zstd(path):
+    try:
+        from compression import zstd
+        return zstd.open(path, 'wt', newline='')
+    except ImportError:
+        pass
+    import zstandard
+    return zstandard.open(path, 'wt', newline='')
+
+class TextWriter():
+    """
+    Buffered, correctly quoted delimited text writer.
+    """
+    columnar = False
+
+    def __init__(self, path, columns=None, delimiter='\t', header=True):
+        self.path = path
+        if path is None:
+            self.fh = sys.stdout
+        else:
+            base, compression = _strip_compression(path)
+            if compression in ('.gz', '.bgz'):
+                import gzip
+                self.fh = gzip.open(path, 'wt', newline='', compresslevel=6)
+            elif compression == '.zst':
+                self.fh = _open_zstd(path)
+            else:
+                self.fh = open(path, 'w', newline='', buffering=text_buffer)
+        self.delimiter = delimiter
+        self.writer = csv.writer(self.fh, delimiter=delimiter,
+            lineterminator='\n')
+        if columns and header:
+            self.writer.writerow(columns)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+
+    def write_text(self, text):
+        """
+        Write lines that have already been joined with `self.delimiter`, for
+        callers that format rows in bulk (e.g. in worker processes). No
+        quoting is done.
+        """
+        self.fh.write(text)
+
+    def close(self):
+        if self.path is None:
+            self.fh.flush()
+        else:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ArrowWriter():
+    """
+    Write rows out as Parquet or Arrow IPC record batches. All columns are
+    stored as strings, just as they would be in the text output.
+    """
+    columnar = True
+
+    def __init__(self, path, columns, fmt):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.path = path
+        self.columns = list(columns)
+        self.schema = pa.schema([(c, pa.string()) for c in self.columns])
+        self.rows = []
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema,
+                compression='zstd')
+        else:
+            self.sink = pa.OSFile(path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def _flush(self):
+        if not self.rows:
+            return
+        arrays = [
+            self.pa.array([None if r[i] is None else str(r[i])
+                for r in self.rows], type=self.pa.string())
+            for i in range(len(self.columns))
+        ]
+        self.writer.write_batch(self.pa.RecordBatch.from_arrays(arrays,
+            schema=self.schema))
+        self.rows = []
+
+    def writerow(self, row):
+        if len(row) != len(self.columns):
+            raise ValueError(f'Expected {len(self.columns)} fields, got '
+                f'{len(row)}: {row}')
+        self.rows.append(row)
+        if len(self.rows) >= arrow_batch:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        if hasattr(self, 'sink'):
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_writer(path, columns=None, delimiter='\t', header=True):
+    """
+    Open a writer for `path` (or STDOUT if `path` is None), choosing the
+    format from the file name. `columns` are the column names, which are
+    required for the columnar formats, and are written as the header of text
+    output unless `header` is False. `delimiter` is used for text output when
+    the file name doesn't say which delimiter to use.
+    """
+    if path is None:
+        return TextWriter(None, columns, delimiter, header)
+
+    base, compression = _strip_compression(path)
+    ext = os.path.splitext(base)[1].lower()
+
+    if ext in ('.parquet', '.arrow', '.feather', '.ipc'):
+        if columns is None:
+            raise ValueError('Column names are required for columnar output.')
+        try:
+            import pyarrow # noqa
+        except ImportError:
+            fallback = os.path.splitext(base)[0] + '.tsv.gz'
+            sys.stderr.write(f"WARN: pyarrow is not installed. Writing gzipped "
+                f"TSV to '{fallback}' instead.\n")
+            return TextWriter(fallback, columns, '\t', header)
+        return ArrowWriter(path, columns,
+            'parquet' if ext == '.parquet' else 'ipc')
+
+    if ext == '.csv':
+        delimiter = ','
+    elif ext == '.tsv':
+        delimiter = '\t'
+
+    if compression == '.zst':
+        try:
+            _open_zstd(os.devnull).close()
+        except ImportError:
+            path = base + '.gz'
+            sys.stderr.write(f"WARN: zstd compression is not available. "
+                f"Writing to '{path}' instead.\n")
+    return TextWriter(path, columns, delimiter, header)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# Lightweight, opt-in instrumentation shared by the Python tools in this repo.
+################################################################################
+"""
+Timing spans, counters, and optional peak memory and cProfile capture for the
+biofx tools. Nothing is recorded unless profiling is turned on, either with the
+'--profile <trace_file>' option of a tool, or with the environment variables:
+
+    BIOFX_PROFILE=<trace_file>         Turn on spans and counters.
+    BIOFX_PROFILE_MEMORY=1             Also capture peak memory (tracemalloc).
+    BIOFX_PROFILE_CPROFILE=<prof_file> Also dump cProfile stats.
+    BIOFX_PROFILE_MAX_EVENTS=<n>       Keep at most this many span events per
+                                       process (default 100000).
+
+The trace file is written when the program exits. It is in the Chrome trace
+event format, so it can be loaded directly into chrome://tracing or Perfetto,
+and also has a summary of the spans, counters and peak memory for the run.
+
+Since '--profile' is picked up from sys.argv when this module is imported, the
+`timed` decorator knows at import time whether profiling is on, and returns
+the undecorated function when it is not.
+
+Spans from multiprocessing workers are written to part files as the workers
+exit, and merged into the trace by the main process.
+
+The span summary is kept up to date as spans finish, but only the first
+BIOFX_PROFILE_MAX_EVENTS span events are kept for the trace itself, so that a
+long running process (e.g. the biofx.py server) doesn't grow without limit.
+"""
+import sys
+import os
+import json
+import time
+import atexit
+import threading
+
+from contextlib import contextmanager
+from functools import wraps
+
+_enabled = False
+_path = None
+_root = True
+_events = []
+_stats = {}
+_dropped = 0
+_max_events = int(os.environ.get('BIOFX_PROFILE_MAX_EVENTS', 100000))
+_counters = {}
+_lock = threading.Lock()
+_t0 = time.perf_counter()
+_wall0 = time.time()
+_memory = False
+_profiler = None
+
+def add_argument(parser, **kwargs):
+    """
+    Add the standard '--profile' option to a tool's argument parser. Any
+    keyword arguments (e.g. `default`) are passed on to `add_argument`.
+    """
+    parser.add_argument(
+        '--profile',
+        metavar='<trace_file>',
+        help='Write a JSON / Chrome trace file of timing spans and counters '
+            'for this run. Can also be turned on with the BIOFX_PROFILE '
+            'environment variable.',
+        **kwargs
+    )
+
+def enabled():
+    return _enabled
+
+def enable(path, memory=False, cprofile=None):
+    """
+    Turn on profiling for this process (and any child processes), writing the
+    trace to `path` at exit.
+    """
+    global _enabled, _path, _root, _memory, _profiler
+
+    _enabled = True
+    _path = os.path.abspath(path)
+    _memory = memory
+    os.environ['BIOFX_PROFILE'] = _path
+    root_pid = os.environ.setdefault('BIOFX_PROFILE_ROOT', str(os.getpid()))
+    _root = root_pid == str(os.getpid())
+
+    if _memory:
+        import tracemalloc
+        tracemalloc.start()
+    if cprofile and _root:
+        import cProfile
+        _profiler = (cProfile.Profile(), cprofile)
+        _profiler[0].enable()
+
+    import multiprocessing.util
+    multiprocessing.util.register_after_fork(sys.modules[__name__],
+        _after_fork)
+    atexit.register(write)
+
+def _after_fork(obj):
+    # Forked workers start with a clean slate, and write their own part file
+    # when they exit.
+    global _root, _profiler, _dropped
+    import multiprocessing.util
+
+    _root = False
+    _profiler = None
+    _dropped = 0
+    del _events[:]
+    _stats.clear()
+    _counters.clear()
+    multiprocessing.util.Finalize(None, write, exitpriority=100)
+
+def _now():
+    return (time.perf_counter() - _t0) * 1e6
+
+def _add_stats(stats, name, count, total, longest):
+    entry = stats.setdefault(name, {'count' : 0, 'total_s' : 0.0,
+        'max_s' : 0.0})
+    entry['count'] += count
+    entry['total_s'] += total
+    entry['max_s'] = max(entry['max_s'], longest)
+
+@contextmanager
+def _span(name, args):
+    global _dropped
+    start = _now()
+    try:
+        yield
+    finally:
+        dur = _now() - start
+        with _lock:
+            _add_stats(_stats, name, 1, dur / 1e6, dur / 1e6)
+            if len(_events) >= _max_events:
+                _dropped += 1
+            else:
+                event = {
+                    'name' : name,
+                    'cat'  : 'biofx',
+                    'ph'   : 'X',
+                    'ts'   : round(start, 1),
+                    'dur'  : round(dur, 1),
+                    'pid'  : os.getpid(),
+                    'tid'  : threading.get_ident(),
+                }
+                if args:
+                    event['args'] = args
+                _events.append(event)
+
+@contextmanager
+def _null_span():
+    yield
+
+def span(name, **args):
+    """
+    Context manager that records the time spent in the block as a span.
+    """
+    if not _enabled:
+        return _null_span()
+    return _span(name, args)
+
+def timed(name=None):
+    """
+    Decorator that records each call of the function as a span. Returns the
+    function untouched when profiling is off.
+    """
+    def decorator(func):
+        if not _enabled:
+            return func
+        # Use the file name rather than __module__, which is '__main__' when
+        # the tool is run as a script.
+        module = os.path.splitext(os.path.basename(
+            func.__code__.co_filename))[0]
+        span_name = name or f'{module}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(span_name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    """
+    Add `n` to the counter `name`.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def summarize(stats):
+    """
+    Round and sort the per span stats, longest total time first.
+    """
+    spans = {name : {'count' : v['count'], 'total_s' : round(v['total_s'], 6),
+        'max_s' : round(v['max_s'], 6)} for name, v in stats.items()}
+    return dict(sorted(spans.items(), key=lambda x: -x[1]['total_s']))
+
+def _part_data():
+    with _lock:
+        data = {
+            'pid'      : os.getpid(),
+            'wall0'    : _wall0,
+            'events'   : list(_events),
+            'stats'    : {k : dict(v) for k, v in _stats.items()},
+            'dropped'  : _dropped,
+            'counters' : dict(_counters),
+        }
+    if _memory:
+        import tracemalloc
+        data['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    return data
+
+def _merge_parts(data, peaks):
+    import glob
+
+    for part_file in glob.glob(f'{_path}.*.part'):
+        try:
+            with open(part_file) as fh:
+                part = json.load(fh)
+            os.unlink(part_file)
+        except (OSError, ValueError):
+            continue
+        # Line the worker's clock up with ours.
+        shift = (part['wall0'] - _wall0) * 1e6
+        for event in part['events']:
+            event['ts'] = round(event['ts'] + shift, 1)
+            data['events'].append(event)
+        for name, v in part['stats'].items():
+            _add_stats(data['stats'], name, v['count'], v['total_s'],
+                v['max_s'])
+        data['dropped'] += part['dropped']
+        for k, v in part['counters'].items():
+            data['counters'][k] = data['counters'].get(k, 0) + v
+        if 'peak_memory' in part:
+            peaks[str(part['pid'])] = part['peak_memory']
+
+def write():
+    """
+    Write out the trace file (or a part file, if this is a worker process).
+    """
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+
+    if not _root:
+        with open(f'{_path}.{os.getpid()}.part', 'w') as fh:
+            json.dump(_part_data(), fh)
+        return
+
+    if _profiler:
+        profiler, prof_file = _profiler
+        profiler.disable()
+        profiler.dump_stats(prof_file)
+
+    data = _part_data()
+    peaks = {}
+    if 'peak_memory' in data:
+        peaks[str(os.getpid())] = data['peak_memory']
+    _merge_parts(data, peaks)
+    events, counters = data['events'], data['counters']
+
+    wall = _now()
+    if counters:
+        events.append({'name' : 'counters', 'ph' : 'C', 'ts' : round(wall, 1),
+            'pid' : os.getpid(), 'args' : counters})
+
+    trace = {
+        'traceEvents'     : events,
+        'displayTimeUnit' : 'ms',
+        'command'         : ' '.join(sys.argv),
+        'wall_s'          : round(wall / 1e6, 6),
+        'spans'           : summarize(data['stats']),
+        'counters'        : counters,
+    }
+    if data['dropped']:
+        trace['dropped_events'] = data['dropped']
+        sys.stderr.write(f"WARN: Dropped {data['dropped']} profile span "
+            'events over the BIOFX_PROFILE_MAX_EVENTS limit; they are still '
+            'in the span summary.\n')
+    if peaks:
+        trace['peak_memory_bytes'] = peaks
+    with open(_path, 'w') as fh:
+        json.dump(trace, fh)
+    sys.stderr.write(f"Wrote profile trace to '{_path}'.\n")
+
+def _from_argv(argv):
+    for i, arg in enumerate(argv):
+        if arg == '--profile' and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith('--profile='):
+            return arg.split('=', 1)[1]
+    return None
+
+_trace = _from_argv(sys.argv) or os.environ.get('BIOFX_PROFILE')
+if _trace:
+    enable(_trace,
+        memory=os.environ.get('BIOFX_PROFILE_MEMORY', '') not in ('', '0'),
+        cprofile=os.environ.get('BIOFX_PROFILE_CPROFILE'))
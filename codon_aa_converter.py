@@ -10,19 +10,77 @@
 If input a three base sequence (i.e. codon), return an Amino Acid. If enter
 Amino Acid (either three letter or one letter), return a list of possibly codons
 that could make that amino acid.
+
+With '--reverse', treat the query as a peptide (single letter code) and return
+the IUPAC degenerate DNA sequence that encodes it, along with the number of
+sequences the degenerate sequence expands to and the number of DNA sequences
+that actually encode the peptide.  The degenerate sequence is a superset: for
+residues whose codons differ at more than one position (L, R, S and stop), it
+also covers codons of other residues (e.g. 'YTN' for L includes TTT and TTC,
+which are F).  Use '-n' to list the concrete sequences, starting with the most
+used codons, optionally filtered by GC content and restriction sites.
+
+With '--stats', treat the query as a FASTA file of coding sequences, and output
+the codon usage (counts, frequency per thousand and RSCU) and amino acid
+composition across all of them.  A per gene matrix of codon counts and GC3 can
+be written with '--matrix'.  This mode requires NumPy.
 """
 import sys
+import math
 import argparse
+import biofx_profile
 
 from collections import defaultdict
+from itertools import groupby
 from pprint import pprint as pp # noqa
 
-version = '1.0.012521'
+version = '1.2.101826'
 
 # Globals
 single_letter = list('ACDEFGHIKLMNPQRSTVWY*')
 three_letter = ('Ala Cys Asp Glu Phe Gly His Ile Lys Leu Met Asn Pro Gln '
         'Arg Ser Thr Val Trp Tyr Ter').split()
+single_to_three = dict(zip(single_letter, three_letter))
+three_to_single = dict(zip(three_letter, single_letter))
+
+# Build the codon tables once, rather than on every lookup.
+bases = 'TCAG'
+codons = [a + b + c for a in bases for b in bases for c in bases]
+amino_acids = ('FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVV'
+    'AAAADDEEGGGG')
+codon_table = dict(zip(codons, amino_acids))
+aa_to_codons = defaultdict(list)
+for _codon, _aa in codon_table.items():
+    aa_to_codons[_aa].append(_codon)
+
+# Homo sapiens codon usage, as frequency per thousand codons (Kazusa codon
+# usage database, from GenBank release 160).
+human_codon_usage = {
+    'TTT' : 17.6, 'TCT' : 15.2, 'TAT' : 12.2, 'TGT' : 10.6,
+    'TTC' : 20.3, 'TCC' : 17.7, 'TAC' : 15.3, 'TGC' : 12.6,
+    'TTA' : 7.7,  'TCA' : 12.2, 'TAA' : 1.0,  'TGA' : 1.6,
+    'TTG' : 12.9, 'TCG' : 4.4,  'TAG' : 0.8,  'TGG' : 13.2,
+    'CTT' : 13.2, 'CCT' : 17.5, 'CAT' : 10.9, 'CGT' : 4.5,
+    'CTC' : 19.6, 'CCC' : 19.8, 'CAC' : 15.1, 'CGC' : 10.4,
+    'CTA' : 7.2,  'CCA' : 16.9, 'CAA' : 12.3, 'CGA' : 6.2,
+    'CTG' : 39.6, 'CCG' : 6.9,  'CAG' : 34.2, 'CGG' : 11.4,
+    'ATT' : 16.0, 'ACT' : 13.1, 'AAT' : 17.0, 'AGT' : 12.1,
+    'ATC' : 20.8, 'ACC' : 18.9, 'AAC' : 19.1, 'AGC' : 19.5,
+    'ATA' : 7.5,  'ACA' : 15.1, 'AAA' : 24.4, 'AGA' : 12.2,
+    'ATG' : 22.0, 'ACG' : 6.1,  'AAG' : 31.9, 'AGG' : 12.0,
+    'GTT' : 11.0, 'GCT' : 18.4, 'GAT' : 21.8, 'GGT' : 10.8,
+    'GTC' : 14.5, 'GCC' : 27.7, 'GAC' : 25.1, 'GGC' : 22.2,
+    'GTA' : 7.1,  'GCA' : 15.8, 'GAA' : 29.0, 'GGA' : 16.5,
+    'GTG' : 28.1, 'GCG' : 7.4,  'GAG' : 39.6, 'GGG' : 16.5,
+}
+
+iupac_codes = {
+    frozenset('A') : 'A', frozenset('C') : 'C', frozenset('G') : 'G',
+    frozenset('T') : 'T', frozenset('AG') : 'R', frozenset('CT') : 'Y',
+    frozenset('CG') : 'S', frozenset('AT') : 'W', frozenset('GT') : 'K',
+    frozenset('AC') : 'M', frozenset('CGT') : 'B', frozenset('AGT') : 'D',
+    frozenset('ACT') : 'H', frozenset('ACG') : 'V', frozenset('ACGT') : 'N',
+}
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
@@ -38,7 +96,72 @@ def get_args():
         action = 'version',
         version = '%(prog)s - v' + version
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '-r', '--reverse',
+        action='store_true',
+        help='Treat the query as a peptide (or comma separated list of '
+            'peptides) in single letter code, and reverse translate it to DNA.'
+    )
+    parser.add_argument(
+        '-n', '--num',
+        type=int,
+        metavar='INT',
+        default=0,
+        help='With --reverse, list up to this many of the DNA sequences that '
+            'encode the peptide. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--gc',
+        metavar='<min,max>',
+        help='With --reverse, only count and list sequences with a GC fraction '
+            'in this range (e.g. 0.4,0.6).'
+    )
+    parser.add_argument(
+        '--exclude-sites',
+        metavar='<site1,site2,...>',
+        help='With --reverse, do not list sequences that contain any of these '
+            'sites (e.g. restriction sites) on either strand. Sites are not '
+            'taken into account in the count.'
+    )
+    parser.add_argument(
+        '-s', '--stats',
+        action='store_true',
+        help='Treat the query as a FASTA file (or - for STDIN) of coding '
+            'sequences, and output codon usage and amino acid composition.'
+    )
+    parser.add_argument(
+        '-p', '--procs',
+        type=int,
+        metavar='INT',
+        default=4,
+        help='With --stats, number of processes to use. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '--matrix',
+        metavar='<file>',
+        help='With --stats, write a per gene matrix of codon counts and GC3 '
+            "to this file. Use '.npz' for a compressed NumPy matrix, or any of "
+            'the usual table formats (.tsv, .tsv.gz, .parquet, ...).'
+    )
+    parser.add_argument(
+        '--no-usage',
+        action='store_true',
+        help='With --reverse, list codons in table order rather than ordering '
+            'them by human codon usage.'
+    )
+    biofx_profile.add_argument(parser)
+    args = parser.parse_args()
+
+    if args.gc:
+        try:
+            args.gc = tuple(float(x) for x in args.gc.split(','))
+            assert len(args.gc) == 2
+        except (ValueError, AssertionError):
+            sys.stderr.write("Error: GC range must be in the form 'min,max'.\n")
+            sys.exit(1)
+    if args.exclude_sites:
+        args.exclude_sites = args.exclude_sites.split(',')
+    return args
 
 def convert_aa(query):
     """
@@ -47,11 +170,9 @@ def convert_aa(query):
     """
     res = ''
     if len(query) == 1:
-        conv_dict = dict(zip(single_letter, three_letter))
-        res = conv_dict.get(query.title(), None)
+        res = single_to_three.get(query.title(), None)
     elif len(query) == 3:
-        conv_dict = dict(zip(three_letter, single_letter))
-        res = conv_dict.get(query.title(), None)
+        res = three_to_single.get(query.title(), None)
     else:
         sys.stderr.write(f"Error: '{query}' does not seem to be an appropriate "
                 "amino acid string.\n")
@@ -63,18 +184,13 @@ def convert_aa(query):
 
     return res
 
+@biofx_profile.timed()
 def translate(query, direction):
     """
     Translate the query (either a codon or an amino acid) to the opposite, as
     directed by 'direction'.  Direction can be either 'codon' to translate an
     amino acid to a codon, or 'aa' to translate a codon to an amino acid.
     """
-    bases = 'TCAG'
-    codons = [a + b + c for a in bases for b in bases for c in bases]
-    amino_acids = ('FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVV'
-        'AAAADDEEGGGG')
-    codon_table = dict(zip(codons, amino_acids))
-
     # Translate a codon to amino acid
     if direction == 'aa':
         # Allow for U's to be input.  But, have to convert to T first, or else
@@ -90,20 +206,363 @@ def translate(query, direction):
 
     # Translate an amino acid to codon(s).
     if direction == 'codon':
-        lookup = defaultdict(list)
-        for codon, aa in codon_table.items():
-            lookup[aa].append(codon)
-
         if len(query) == 1:
-            res = lookup.get(query, None)
+            res = aa_to_codons.get(query, None)
         else:
-            res = lookup.get(convert_aa(query), None)
+            res = aa_to_codons.get(convert_aa(query), None)
 
         if res is None:
             sys.stderr.write("Error: Can not translate aa '{query}' to codon!\n")
             sys.exit(1)
         return ','.join(res)
 
+def _codon_choices(peptide, usage=None):
+    """
+    Return a list of the codons that could encode each residue of the peptide,
+    ordered by descending usage if a codon usage table is given.
+    """
+    choices = []
+    for i, aa in enumerate(peptide.upper()):
+        codon_list = aa_to_codons.get(aa)
+        if codon_list is None:
+            sys.stderr.write(f"Error: Can not reverse translate residue '{aa}' "
+                f"at position {i + 1} of '{peptide}'.\n")
+            sys.exit(1)
+        if usage:
+            codon_list = sorted(codon_list, key=lambda c: -usage.get(c, 0))
+        choices.append(codon_list)
+    return choices
+
+def degenerate_dna(peptide):
+    """
+    Return the IUPAC degenerate DNA sequence covering every codon of every
+    residue in the peptide. Each position is made degenerate on its own, so
+    this is a superset: for L, R, S and stop it also covers codons of other
+    residues (see `degenerate_count`).
+    """
+    seq = []
+    for codon_list in _codon_choices(peptide):
+        for pos in range(3):
+            seq.append(iupac_codes[frozenset(c[pos] for c in codon_list)])
+    return ''.join(seq)
+
+def degenerate_count(degenerate):
+    """
+    Return the number of DNA sequences that an IUPAC degenerate sequence
+    expands to. This is more than `count_sequences` for any peptide with a
+    residue whose degenerate codon over-covers.
+    """
+    sizes = {code : len(bases) for bases, code in iupac_codes.items()}
+    return math.prod(sizes[base] for base in degenerate)
+
+def _gc_bounds(length, gc_range):
+    if gc_range is None:
+        return 0, 3 * length
+    return (math.ceil(gc_range[0] * 3 * length - 1e-9),
+        math.floor(gc_range[1] * 3 * length + 1e-9))
+
+def _gc(codon):
+    return codon.count('G') + codon.count('C')
+
+def count_sequences(peptide, gc_range=None):
+    """
+    Return the number of DNA sequences that encode the peptide, without
+    enumerating them. If `gc_range` is given as (min, max) fractions, only
+    count the sequences with GC content in that range, using a running tally
+    of the number of sequences for each GC count.
+    """
+    choices = _codon_choices(peptide)
+    if gc_range is None:
+        return math.prod(len(c) for c in choices)
+
+    tally = {0 : 1}
+    for codon_list in choices:
+        per_gc = defaultdict(int)
+        for codon in codon_list:
+            per_gc[_gc(codon)] += 1
+        new = defaultdict(int)
+        for gc, n in tally.items():
+            for codon_gc, m in per_gc.items():
+                new[gc + codon_gc] += n * m
+        tally = new
+    gc_min, gc_max = _gc_bounds(len(choices), gc_range)
+    return sum(n for gc, n in tally.items() if gc_min <= gc <= gc_max)
+
+def reverse_translate(peptide, usage=human_codon_usage, gc_range=None,
+        exclude_sites=None):
+    """
+    Generator over every DNA sequence that encodes the peptide. Codons for
+    each residue are tried in order of usage, so the first sequence is made
+    of the most used codon for every residue. After that, sequences come out
+    in lexicographic order of each residue's codon rank: the first residue
+    varies the slowest and the last the fastest. This is not best first by
+    overall codon usage; a sequence with a rare codon at the last residue
+    comes before one with the second most used codon at the first.
+
+    This is a depth first walk over the codon choices, so memory is bounded
+    by the length of the peptide.  Branches that can no longer land in
+    `gc_range`, or that make one of `exclude_sites` (on either strand), are
+    pruned as soon as they are found rather than filtered at the end.
+    """
+    choices = _codon_choices(peptide, usage)
+    length = len(choices)
+    if length == 0:
+        return
+    gc_min, gc_max = _gc_bounds(length, gc_range)
+
+    # The min and max GC we can still add from each position to the end.
+    suffix_min = [0] * (length + 1)
+    suffix_max = [0] * (length + 1)
+    for i in range(length - 1, -1, -1):
+        gcs = [_gc(c) for c in choices[i]]
+        suffix_min[i] = suffix_min[i + 1] + min(gcs)
+        suffix_max[i] = suffix_max[i + 1] + max(gcs)
+
+    sites = set()
+    for site in exclude_sites or []:
+        site = site.upper()
+        sites.update((site, site.translate(str.maketrans('ACGT', 'TGCA'))[::-1]))
+    # Number of previous codons that a new site could reach back into.
+    lookback = max((math.ceil(len(s) / 3) for s in sites), default=0)
+
+    seq = []
+    gc_prefix = [0] * (length + 1)
+    stack = [iter(choices[0])]
+    while stack:
+        i = len(stack) - 1
+        for codon in stack[-1]:
+            gc = gc_prefix[i] + _gc(codon)
+            if (gc + suffix_min[i + 1] > gc_max or
+                    gc + suffix_max[i + 1] < gc_min):
+                continue
+            if sites:
+                tail = ''.join(seq[len(seq) - lookback:]) + codon
+                if any(s in tail for s in sites):
+                    continue
+            if i + 1 == length:
+                yield ''.join(seq) + codon
+                continue
+            seq.append(codon)
+            gc_prefix[i + 1] = gc
+            stack.append(iter(choices[i + 1]))
+            break
+        else:
+            stack.pop()
+            if seq:
+                seq.pop()
+
+def reverse_main(input_string, num, gc_range, exclude_sites, usage):
+    """
+    Reverse translate each peptide, printing the degenerate sequence, the
+    number of sequences it expands to, and the number of sequences that
+    encode the peptide, and optionally listing some of them.
+    """
+    print('Peptide\tDegenerate\tExpanded\tCount')
+    for peptide in input_string.split(','):
+        degenerate = degenerate_dna(peptide)
+        print('\t'.join((peptide, degenerate,
+            str(degenerate_count(degenerate)),
+            str(count_sequences(peptide, gc_range)))))
+        if num:
+            generator = reverse_translate(peptide, usage, gc_range,
+                exclude_sites)
+            for n, seq in enumerate(generator, start=1):
+                gc = (seq.count('G') + seq.count('C')) / len(seq)
+                print(f'  {seq}\tGC={gc:.3f}')
+                if n == num:
+                    break
+
+def read_fasta(fasta):
+    """
+    Generator that yields (name, sequence) for each record of a FASTA file.
+    """
+    import biofx_batch
+
+    with biofx_batch.open_input(fasta) as fh:
+        lines = (line.rstrip() for line in fh)
+        name = None
+        for is_header, group in groupby(lines, key=lambda x: x.startswith('>')):
+            if is_header:
+                name = list(group)[-1][1:].split()[0]
+            elif name is not None:
+                yield name, ''.join(group)
+
+def require_numpy(what):
+    """
+    Exit with an error if NumPy, which the vectorized codon functions need,
+    isn't installed.
+    """
+    try:
+        import numpy # noqa
+    except ImportError:
+        sys.stderr.write(f'ERROR: NumPy is required for {what}.\n')
+        sys.exit(1)
+
+def _codon_lookup():
+    """
+    Lookup table from a base's byte value to its index in 'TCAG' (U counts as
+    T), with 4 for anything else. Codon indices then match the `codons` list.
+    """
+    import numpy as np
+
+    lut = np.full(256, 4, dtype=np.uint8)
+    for i, base in enumerate('TCAG'):
+        lut[ord(base)] = lut[ord(base.lower())] = i
+    lut[ord('U')] = lut[ord('u')] = 0
+    return lut
+
+def encode_cds(seq, lut, drop_invalid=True):
+    """
+    Encode a coding sequence as a NumPy array of codon indices (0-63),
+    dropping any trailing partial codon. Codons with a base that is not A, C,
+    G, T or U are dropped, or if `drop_invalid` is False, kept in place as 64
+    so that the array lines up with the codon positions.
+    """
+    import numpy as np
+
+    bases = lut[np.frombuffer(seq.encode(), dtype=np.uint8)]
+    bases = bases[:len(bases) - len(bases) % 3].reshape(-1, 3)
+    valid = (bases < 4).all(axis=1)
+    if drop_invalid:
+        bases = bases[valid]
+    idx = bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]
+    if not drop_invalid:
+        idx[~valid] = 64
+    return idx
+
+def _count_chunk(records):
+    import numpy as np
+
+    lut = _codon_lookup()
+    names = [name for name, seq in records]
+    counts = np.zeros((len(records), 64), dtype=np.uint32)
+    for i, (name, seq) in enumerate(records):
+        counts[i] = np.bincount(encode_cds(seq, lut), minlength=64)
+    return names, counts
+
+def codon_counts(fasta, procs=4, chunk_size=2000):
+    """
+    Count the codons in each record of a CDS FASTA file, splitting the records
+    across `procs` processes in chunks. Returns a list of record names and an
+    (n_records x 64) matrix of codon counts, in `codons` order.
+    """
+    import multiprocessing
+    import numpy as np
+    import biofx_batch
+
+    chunks = biofx_batch.chunked(read_fasta(fasta), chunk_size)
+    if procs > 1:
+        pool = multiprocessing.Pool(processes=procs)
+        results = pool.imap(_count_chunk, chunks)
+    else:
+        pool = None
+        results = map(_count_chunk, chunks)
+
+    names = []
+    matrices = []
+    try:
+        for chunk_names, chunk_counts in results:
+            names.extend(chunk_names)
+            matrices.append(chunk_counts)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if not matrices:
+        return names, np.zeros((0, 64), dtype=np.uint32)
+    return names, np.vstack(matrices)
+
+def _aa_index():
+    # Index of each codon's amino acid in `single_letter`.
+    import numpy as np
+    return np.array([single_letter.index(codon_table[c]) for c in codons])
+
+def rscu(counts):
+    """
+    Relative synonymous codon usage for a vector of 64 codon counts: the
+    count of each codon divided by the mean count of the codons for its amino
+    acid. Amino acids that are not seen get 0.
+    """
+    import numpy as np
+
+    aa_idx = _aa_index()
+    aa_totals = np.bincount(aa_idx, weights=counts, minlength=21)
+    n_syn = np.bincount(aa_idx, minlength=21)
+    expected = aa_totals[aa_idx] / n_syn[aa_idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(expected > 0, counts / expected, 0.0)
+
+def gc3(counts):
+    """
+    GC content at the third codon position over the sense codons, for a
+    vector of 64 codon counts or a matrix of them (one row per record).
+    """
+    import numpy as np
+
+    sense = np.array([codon_table[c] != '*' for c in codons])
+    third_gc = np.array([c[2] in 'GC' for c in codons]) & sense
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nan_to_num((counts @ third_gc) / (counts @ sense))
+
+def aa_composition(counts):
+    """
+    Count of each amino acid (in `single_letter` order) for a vector of 64
+    codon counts.
+    """
+    import numpy as np
+    return np.bincount(_aa_index(), weights=counts, minlength=21)
+
+def write_matrix(outfile, names, counts):
+    """
+    Write the per gene codon count matrix, along with each gene's codon total
+    and GC3.
+    """
+    import numpy as np
+    import biofx_output
+
+    gc3s = gc3(counts)
+    if outfile.endswith('.npz'):
+        np.savez_compressed(outfile, names=np.array(names), codons=
+            np.array(codons), counts=counts, gc3=gc3s)
+        return
+
+    with biofx_output.open_writer(outfile, ['gene', 'codons', 'gc3'] +
+            codons) as writer:
+        totals = counts.sum(axis=1)
+        for name, total, g, row in zip(names, totals, gc3s, counts):
+            writer.writerow([name, int(total), f'{g:.4f}'] + row.tolist())
+
+def stats_main(fasta, procs, matrix_file):
+    """
+    Print the overall codon usage and amino acid composition for a CDS FASTA
+    file, and optionally write out the per gene matrix.
+    """
+    require_numpy('--stats')
+
+    with biofx_profile.span('codon_aa_converter.codon_counts'):
+        names, counts = codon_counts(fasta, procs)
+    biofx_profile.count('records', len(names))
+    totals = counts.sum(axis=0, dtype='uint64').astype(float)
+    n_codons = totals.sum()
+    sys.stderr.write(f'Counted {int(n_codons)} codons in {len(names)} records.'
+        f' GC3: {gc3(totals):.4f}\n')
+
+    print('Codon\tAA\tCount\tPer_Thousand\tRSCU')
+    for codon, count, r in zip(codons, totals, rscu(totals)):
+        per_thousand = 1000 * count / n_codons if n_codons else 0
+        print(f'{codon}\t{codon_table[codon]}\t{int(count)}\t'
+            f'{per_thousand:.2f}\t{r:.3f}')
+
+    print('\nAA\tThree\tCount\tFraction')
+    for aa, count in zip(single_letter, aa_composition(totals)):
+        fraction = count / n_codons if n_codons else 0
+        print(f'{aa}\t{single_to_three[aa]}\t{int(count)}\t{fraction:.4f}')
+
+    if matrix_file:
+        sys.stderr.write(f"Writing per gene matrix to '{matrix_file}'.\n")
+        write_matrix(matrix_file, names, counts)
+
 def main(input_string):
     """
     Determine if we have a codon or an amino acid string, and return the
@@ -111,6 +570,7 @@ def main(input_string):
     """
     query_list = input_string.split(',')
     results = []
+    biofx_profile.count('records', len(query_list))
 
     for query in query_list:
         if all(x in ('A', 'C', 'T', 'G', 'U') for x in query.upper()):
@@ -143,4 +603,10 @@ def main(input_string):
 
 if __name__ == '__main__':
     args = get_args()
-    main(args.query)
+    if args.stats:
+        stats_main(args.query, args.procs, args.matrix)
+    elif args.reverse:
+        reverse_main(args.query, args.num, args.gc, args.exclude_sites,
+            None if args.no_usage else human_codon_usage)
+    else:
+        main(args.query)
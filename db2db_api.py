@@ -6,12 +6,20 @@ Input an Ensembl gene ID or a flat file of Ensembl gene IDs, and return the
 HGNC ID and the official gene symbol using the NCI's db2db service.
 """
 import sys
+import os
 import argparse
 import requests
+import biofx_profile
+import biofx_batch
+import biofx_output
 
 from pprint import pprint as pp # noqa
 
-version = '1.0.020221'
+version = '1.1.101826'
+biodbnet_url = os.environ.get(
+    'BIOFX_BIODBNET_URL',
+    'https://biodbnet-abcc.ncifcrf.gov/webServices/rest.php/biodbnetRestApi.json'
+)
 
 def get_args():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -28,17 +36,22 @@ def get_args():
     parser.add_argument(
         '-o', '--outfile',
         metavar='<output_file>',
-        help='Write results to an output file rather than stdout.'
+        help="Write results to an output file rather than stdout. Add '.gz' "
+            "or '.zst' to compress, or use '.parquet' or '.arrow' for "
+            "columnar output."
     )
     parser.add_argument(
         '-v', '--version',
         action='version',
         version=f'{parser.prog} - v{version}'
     )
+    biofx_profile.add_argument(parser)
     return parser.parse_args()
 
 
+@biofx_profile.timed()
 def api_call(url, query):
+        biofx_profile.count('requests')
         s = requests.Session()
         request = s.get(url, params=query)
         try:
@@ -51,24 +64,15 @@ def api_call(url, query):
 def print_results(result, outfile):
     if outfile:
         sys.stderr.write(f"Writing results to '{outfile}'.\n")
-        outfh = open(outfile, 'w')
-    else:
-        outfh = sys.stdout 
-
-    outfh.write('\t'.join(['Ensembl_ID', 'Gene', 'HNGC_ID']))
-    outfh.write('\n')
-
-    for r in result:
-        outfh.write('\t'.join(
-            [r, result[r].get('gene_symbol'), result[r].get('hgnc_id')]
-        ))
-        outfh.write('\n')
 
-def __read_batch(f):
-    with open(f) as fh:
-        #  return ','.join([x.rstrip('\n') for x in fh])
-        return [x.rstrip('\n') for x in fh]
+    columns = ['Ensembl_ID', 'Gene', 'HNGC_ID']
+    with biofx_output.open_writer(outfile, columns) as writer:
+        for r in result:
+            writer.writerow(
+                [r, result[r].get('gene_symbol'), result[r].get('hgnc_id')]
+            )
 
+@biofx_profile.timed('db2db_api.proc_ret_data')
 def __proc_ret_data(d):
     proc = {}
     for ent in d:
@@ -89,6 +93,7 @@ def __proc_ret_data(d):
                 sys.stderr.write(f"offending record: {d[ent]}\n")
                 raise
 
+        biofx_profile.count('records')
         proc[ensid] = {
             'gene_symbol' : gene_symbols,
             'hgnc_id'     : hgnc_ids
@@ -96,14 +101,13 @@ def __proc_ret_data(d):
     return proc
 
 def main(query_list, outfile):
-    url ='https://biodbnet-abcc.ncifcrf.gov/webServices/rest.php/biodbnetRestApi.json'
+    url = biodbnet_url
 
     results = {}
     # Need to chop up the queries to be no more than 250, or else we get an 
     # error that the URL is too long.  So, just split these into 250 query
     # chunks and process one at a time.
-    for i in range(0, len(query_list), 250):
-        chunk = query_list[i:i+250]
+    for chunk in biofx_batch.chunked(query_list, 250):
         queries = ','.join(chunk)
 
         params = {
@@ -126,7 +130,7 @@ if __name__ == '__main__':
         sys.stderr.write("ERROR: You must either input a single query or a "
                 "batchfile of queries.")
     elif (args.batchfile):
-        queries = __read_batch(args.batchfile)
+        queries = biofx_batch.read_batch(args.batchfile, dedupe=True)
     else:
         queries = args.query.split(',')
 
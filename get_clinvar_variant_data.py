@@ -12,10 +12,15 @@ import requests
 import re
 import argparse
 import csv
+import biofx_profile
+import biofx_batch
+import biofx_output
 
 from pprint import pprint as pp
 
-version = '2.0_111417'
+version = '2.1_101826'
+eutils_url = os.environ.get('BIOFX_EUTILS_URL',
+    'https://eutils.ncbi.nlm.nih.gov/entrez/eutils')
 
 
 def get_args():
@@ -26,13 +31,16 @@ def get_args():
     parser.add_argument('clinvar_id', metavar = '<clinvar_id>', nargs = '?', 
         help='ID or Comma separated list of IDs to search')
     parser.add_argument('-d','--delimiter', metavar = '<delimiter>', default = 'tab',
-        help='Delimiter to use for output. Can choose from "comma" or "tab" for now') 
+        help='Delimiter to use for output. Can choose from "comma" or "tab" for now. '
+            'The output file extension (e.g. ".csv.gz", ".parquet") takes precedence.') 
     parser.add_argument('-b', '--batch', metavar = '<batchfile>', 
         help='Batchfile of IDs to search')
     parser.add_argument('-o', '--output', metavar = '<output_file>', 
-        help = "Output file to write to. DEFAULT: STDOUT")
+        help = "Output file to write to. Add '.gz' or '.zst' to compress, or use '.parquet' or "
+            "'.arrow' for columnar output. DEFAULT: STDOUT")
     parser.add_argument('-v', '--version', action='version', 
         version = '%(prog)s - ' + version)
+    biofx_profile.add_argument(parser)
     args = parser.parse_args()
 
     if not args.clinvar_id and not args.batch:
@@ -70,20 +78,19 @@ def clinical_significance_filter(data, input_terms):
     }
 
 
-def read_varlist(varlist):
-    with open(varlist) as fh:
-        return [x.rstrip('\n') for x in fh if x]
-
+@biofx_profile.timed()
 def get_pmid(varid):
     """
     Input the same Clinvar ID and return PMIDs that cite the clinical evidence 
     for that call. This will return the PubMed link under the "Citations" 
     section of the Clinvar report.
     """
-    url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi?dbfrom=clinvar&db=pubmed&id=' + varid + '&format=json'
+    url = eutils_url + '/elink.fcgi?dbfrom=clinvar&db=pubmed&id=' + varid + '&format=json'
     pmids = []
 
-    r = requests.get(url)
+    biofx_profile.count('requests')
+    with biofx_profile.span('get_clinvar_variant_data.api_call'):
+        r = requests.get(url)
     ret_data = r.json()
 
     for i in ret_data['linksets']:
@@ -95,10 +102,13 @@ def get_pmid(varid):
     else:
         return '-'
 
+@biofx_profile.timed()
 def get_clinvar_data(varid):
     '''sample url: https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=clinvar&id=65533&retmode=json'''
-    url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?db=clinvar&id=' + varid + '&retmode=json'
-    req = requests.get(url)
+    url = eutils_url + '/esummary.fcgi?db=clinvar&id=' + varid + '&retmode=json'
+    biofx_profile.count('requests')
+    with biofx_profile.span('get_clinvar_variant_data.api_call'):
+        req = requests.get(url)
     json_data = req.json()
     pmid = get_pmid(varid)
     json_data['result'][varid].update({'pmid' : pmid})
@@ -131,15 +141,13 @@ def get_var_ids(refs,wanted_id):
     ref_list = {elem['db_source'] : elem['db_id'] for elem in refs}
     return ref_list[wanted_id]
 
-def gen_output_handle(arg):
-    # TODO: Fix this to use the CSV module so that we can better handle commas in fields.
+def gen_output_handle(arg, columns, delimiter):
     if arg:
         print("Writing output to {}".format(arg))
-        return open(arg,'w')
-    else:
-        return sys.stdout
+    return biofx_output.open_writer(arg, columns, delimiter)
 
-def parse_json(json,varid,outfile,delimiter):
+@biofx_profile.timed()
+def parse_json(json,varid,writer):
     """
     Parse the JSON file and output only the info we need
     """
@@ -177,26 +185,27 @@ def parse_json(json,varid,outfile,delimiter):
             # results = results + [gene,transcript,cds,aa,function,varid,significance]
             results = results + [gene,transcript,cds,aa,function,varid,dbsnp_id,significance,review_status,pmid]
             results = list(map(lambda x: x if x else '---', results))
-    print(delimiter.join(results), file=outfile)
+    if results:
+        biofx_profile.count('records')
+        writer.writerow(results)
 
 if __name__=='__main__':
     args = get_args()
     if args.batch:
-        vlist = read_varlist(args.batch)
+        vlist = biofx_batch.read_batch(args.batch, dedupe=True)
     else: 
         vlist = args.clinvar_id.split(',')
 
     delims = { 'tab' : '\t', 'comma' : ',' } 
-    out_fh = gen_output_handle(args.output)
+    columns = ['chr', 'start', 'stop', 'ref', 'alt', 'gene', 'transcript', 'cds', 'aa', 
+        'functional', 'clinvar_id', 'dbsnp_id', 'clinical_significance', 
+        'review_status', 'PMIDs']
+    writer = gen_output_handle(args.output, columns, delims[args.delimiter])
     try: 
-        print(delims[args.delimiter].join(
-            ['chr', 'start', 'stop', 'ref', 'alt', 'gene', 'transcript', 'cds', 'aa', 
-                'functional', 'clinvar_id', 'dbsnp_id', 'clinical_significance', 
-                'review_status', 'PMIDs']
-            ), file=out_fh)
-
         for var in vlist:
             clinvar_json = get_clinvar_data(var)
-            parse_json(clinvar_json,var,out_fh,delims[args.delimiter])
+            parse_json(clinvar_json,var,writer)
     except KeyboardInterrupt:
         sys.exit(9)
+    finally:
+        writer.close()
@@ -7,7 +7,9 @@ import sys
 import os
 import argparse
 import json
-import csv
+import biofx_profile
+import biofx_batch
+import biofx_output
 
 from pprint import pprint as pp
 from collections import defaultdict
@@ -28,9 +30,11 @@ def get_args():
         help='JSON file containing gene / pathway mapping info. Default: '
         '%(default)s.')
     parser.add_argument('-o', '--output', metavar="<output_file>", help='Output'
-        ' file for data. Default: STDOUT')
+        " file for data. Add '.gz' or '.zst' to compress, or use '.parquet' or "
+        "'.arrow' for columnar output. Default: STDOUT")
     parser.add_argument('-v', '--version', action='version', 
             version = '%(prog)s - v' + version)
+    biofx_profile.add_argument(parser)
     args = parser.parse_args()
 
     if not any(x for x in (args.gene, args.batchfile, args.pathway)):
@@ -39,22 +43,25 @@ def get_args():
         sys.exit(1)
     return args
 
+@biofx_profile.timed()
 def parse_json(jfile):
     with open(jfile) as fh:
         return json.load(fh)
 
+@biofx_profile.timed()
 def get_pathway_by_gene(pathway_data, gene_list):
     """
     Input a gene list and output a set of pathways that correspond to that 
     mapping.
     """
     results = {}
-    
+
     for g in gene_list:
         results[g] = []
         for p in pathway_data.keys():
             if g in pathway_data[p]:
                 results[g].append(p)
+    biofx_profile.count('records', len(results))
     return results
         
 def get_gene_by_pathway(pathway_data, pathway):
@@ -76,18 +83,18 @@ def get_gene_by_pathway(pathway_data, pathway):
             sys.stderr.write("ERROR: No such pathway '%s'!\n" % pathway)
             sys.exit(1)
 
-def print_results(data, csv_out):
+def print_results(data, writer):
     for k,v in data.items():
         # Just output a long string of junk if no results found so that we can
         # try to add something later. Will remove later.
         outdata = ['?????????????']
         if v:
             outdata = v
-        csv_out.writerow([k]+outdata)
-
-def read_batchfile(batchfile):
-    with open(batchfile) as fh:
-        return [x.rstrip('\n') for x in fh]
+        if writer.columnar:
+            # Columnar formats need a fixed number of columns.
+            writer.writerow([k, ';'.join(outdata)])
+        else:
+            writer.writerow([k]+outdata)
 
 def main(genes, pathway, jfile, outfile):
     data = parse_json(jfile)
@@ -99,18 +106,15 @@ def main(genes, pathway, jfile, outfile):
     
     if outfile:
         sys.stderr.write('Writing output to {}.\n'.format(outfile))
-        outfh = open(outfile, 'w')
-        csv_out = csv.writer(outfh, lineterminator=os.linesep)
-    else:
-        csv_out = csv.writer(sys.stdout, lineterminator=os.linesep)
-
-    print_results(results, csv_out)
+    with biofx_output.open_writer(outfile, ['query', 'results'], ',',
+            header=False) as writer:
+        print_results(results, writer)
 
 if __name__ == '__main__':
     args = get_args()
     genes = []
     if args.batchfile:
-        genes = read_batchfile(args.batchfile)
+        genes = biofx_batch.read_batch(args.batchfile, dedupe=True)
     elif args.gene:
         genes = args.gene.split(',')
 
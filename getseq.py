@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# Local replacement for getseq.pl. Rather than going out to the UCSC DAS server
+# for each region, read sequence directly from a local, indexed reference FASTA
+# file through mmap so that we can pull large batches of regions very quickly
+# and without a network connection.
+################################################################################
+"""
+Retrieve sequence from a local reference FASTA file. Enter sequence coordinates
+in the form of 'chr:start-stop', and the output will be sequence, padded by 10
+bp. Extra padding can be added with the '-p' option.  The input is flexible and
+can accomodate the following formats:
+
+    chrx:start,stop
+    chrx:start-stop
+    chrx:start..stop (direct cp / paste from COSMIC)
+    x start   stop
+    x:start,stop
+
+Coordinates are 1-based and inclusive, unless a BED file is passed with the
+'--bed' option. If there is no '.fai' index for the reference, one will be
+built next to it.
+"""
+import sys
+import os
+import re
+import mmap
+import argparse
+import biofx_profile
+import biofx_batch
+
+from functools import lru_cache
+from pprint import pprint as pp # noqa
+
+version = '1.0.101826'
+
+complement = bytes.maketrans(b'ACGTURYKMBVDHNacgturykmbvdhn',
+    b'TGCAAYRMKVBHDNtgcaayrmkvbhdn')
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        'regions',
+        nargs='?',
+        metavar='<chr:start-stop>',
+        help='Region, or comma separated list of regions, to retrieve.'
+    )
+    parser.add_argument(
+        '-r', '--reference',
+        metavar='<fasta>',
+        required=True,
+        help='Reference FASTA file from which to pull sequence.'
+    )
+    parser.add_argument(
+        '-b', '--batch',
+        metavar='<batchfile>',
+        help='Batch file of regions, one per line, to retrieve. A region can '
+            'be preceded by a name and a tab to use as the sequence name.'
+    )
+    parser.add_argument(
+        '--bed',
+        metavar='<bed_file>',
+        help='BED file of regions to retrieve. The name and strand columns '
+            'will be used if they exist.'
+    )
+    parser.add_argument(
+        '-p', '--pad',
+        type=int,
+        metavar='INT',
+        default=10,
+        help='Pad the output sequence by this many bases on each side. '
+            'Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-c', '--revcomp',
+        action='store_true',
+        help='Output the reverse complement of the sequence(s).'
+    )
+    parser.add_argument(
+        '-n', '--name',
+        metavar='<name>',
+        help='Custom sequence name for output (DEFAULT: sequence position).'
+    )
+    parser.add_argument(
+        '--cache',
+        type=int,
+        metavar='INT',
+        default=4096,
+        help='Number of regions to keep in the LRU cache. Default: '
+            '%(default)s.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<output_file>',
+        help='Send output to custom file.  Default is STDOUT.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version=f'%(prog)s - v{version}'
+    )
+    biofx_profile.add_argument(parser)
+    args = parser.parse_args()
+
+    if not any((args.regions, args.batch, args.bed)):
+        sys.stderr.write("ERROR: need to enter at least one coordinate to "
+            "search!\n")
+        sys.exit(1)
+    return args
+
+def build_fai(fasta):
+    """
+    Build a samtools compatible '.fai' index for a FASTA file, and return the
+    path to the new index.
+    """
+    fai = fasta + '.fai'
+    sys.stderr.write(f"Building index for '{fasta}'...\n")
+    entries = []
+    with open(fasta, 'rb') as fh:
+        name = None
+        offset = 0
+        length = linebases = linewidth = 0
+        last_short = False
+        pos = 0
+        for line in fh:
+            pos += len(line)
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append((name, length, offset, linebases, linewidth))
+                name = line[1:].split()[0].decode()
+                offset = pos
+                length = linebases = linewidth = 0
+                last_short = False
+                continue
+
+            bases = len(line.rstrip(b'\r\n'))
+            if bases == 0:
+                # Like samtools faidx, only allow empty lines at the end of a
+                # sequence, since the line width arithmetic can't skip them.
+                last_short = True
+                continue
+            if last_short:
+                sys.stderr.write(f"ERROR: Sequence '{name}' has uneven line "
+                    "lengths or empty lines; can not index it.\n")
+                sys.exit(1)
+            if linebases == 0:
+                linebases, linewidth = bases, len(line)
+            elif bases > linebases:
+                sys.stderr.write(f"ERROR: Sequence '{name}' has uneven line "
+                    "lengths; can not index it.\n")
+                sys.exit(1)
+            elif bases < linebases:
+                last_short = True
+            length += bases
+        if name is not None:
+            entries.append((name, length, offset, linebases, linewidth))
+
+    with open(fai, 'w') as outfh:
+        for entry in entries:
+            outfh.write('\t'.join(map(str, entry)) + '\n')
+    return fai
+
+def read_fai(fai):
+    index = {}
+    with open(fai) as fh:
+        for line in fh:
+            name, length, offset, linebases, linewidth = line.split('\t')[:5]
+            index[name] = (int(length), int(offset), int(linebases),
+                int(linewidth))
+    return index
+
+class IndexedFasta():
+    """
+    Random access to an uncompressed FASTA file using its '.fai' index. The
+    file is memory mapped, so only the pages for the regions we ask for are
+    ever read, and the most recently used regions are kept in an LRU cache.
+    """
+    def __init__(self, fasta, cache_size=4096):
+        if fasta.endswith(('.gz', '.bgz')):
+            sys.stderr.write("ERROR: Compressed FASTA files are not supported."
+                " Please decompress the reference first.\n")
+            sys.exit(1)
+        fai = fasta + '.fai'
+        if not os.path.exists(fai):
+            fai = build_fai(fasta)
+        self.index = read_fai(fai)
+        self.fh = open(fasta, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.fetch = lru_cache(maxsize=cache_size)(self._fetch)
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _contig(self, chrom):
+        # Allow for 'chr1' vs '1' naming differences between query and ref.
+        if chrom in self.index:
+            return chrom
+        alt = chrom[3:] if chrom.startswith('chr') else 'chr' + chrom
+        if alt in self.index:
+            return alt
+        raise KeyError(chrom)
+
+    def _fetch(self, chrom, start, end):
+        """
+        Return the sequence of chrom from 0-based start to end (half-open) as
+        bytes. Coordinates are clipped to the ends of the contig.
+        """
+        length, offset, linebases, linewidth = self.index[self._contig(chrom)]
+        start = max(start, 0)
+        end = min(end, length)
+        if start >= end:
+            return b''
+
+        def byte_pos(pos):
+            return offset + (pos // linebases) * linewidth + pos % linebases
+
+        return self.mm[byte_pos(start):byte_pos(end)].translate(None, b'\r\n')
+
+def revcomp(seq):
+    return seq.translate(complement)[::-1]
+
+def parse_region(region):
+    """
+    Parse a 1-based region string in any of the getseq.pl formats, and return
+    (chrom, start, end).
+    """
+    match = re.match(r'^((?:chr)?[\w.]+)[:\t ]+(\d+)(?:[-,.\t ]+(\d+))?$',
+        region.strip())
+    if match is None:
+        raise ValueError(region)
+    chrom, start, end = match.groups()
+    start = int(start)
+    end = int(end) if end else start
+    if end < start:
+        start, end = end, start
+    return chrom, start, end
+
+def proc_batch(batchfile):
+    """
+    Read a getseq.pl style batch file and return a list of
+    (name, chrom, start, end, strand) with 1-based coordinates.
+    """
+    queries = []
+    for line in biofx_batch.read_batch(batchfile):
+        elems = line.split('\t')
+        name = None
+        if len(elems) == 2:
+            name, line = elems
+        chrom, start, end = parse_region(line)
+        queries.append((name, chrom, start, end, '+'))
+    return queries
+
+def proc_bed(bed_file):
+    """
+    Read a BED file and return a list of (name, chrom, start, end, strand)
+    with the coordinates converted to 1-based inclusive.
+    """
+    queries = []
+    with biofx_batch.open_input(bed_file) as fh:
+        for line in fh:
+            if line.startswith(('#', 'track', 'browser')) or not line.strip():
+                continue
+            elems = line.rstrip('\n').split('\t')
+            name = elems[3] if len(elems) > 3 else None
+            strand = elems[5] if len(elems) > 5 else '+'
+            queries.append((name, elems[0], int(elems[1]) + 1, int(elems[2]),
+                strand))
+    return queries
+
+def get_sequences(fasta, queries, pad=0, revcomp_all=False):
+    """
+    Generator that yields (name, sequence) for each query, where queries are
+    (name, chrom, start, end, strand) tuples with 1-based coordinates.
+    """
+    for name, chrom, start, end, strand in queries:
+        try:
+            contig = fasta._contig(chrom)
+            seq = fasta.fetch(contig, start - 1 - pad, end + pad)
+        except KeyError:
+            sys.stderr.write(f"WARN: Can not find contig '{chrom}' in the "
+                "reference. Skipping.\n")
+            continue
+        if revcomp_all != (strand == '-'):
+            seq = revcomp(seq)
+        if name is None:
+            # Name it after the region actually fetched, clipped to the contig.
+            length = fasta.index[contig][0]
+            name = f'{contig}:{max(start - pad, 1)}-{min(end + pad, length)}'
+        yield name, seq.upper().decode()
+
+def main(args):
+    queries = []
+    try:
+        if args.regions:
+            for region in re.split(r',(?=(?:chr)?[\w.]+:)', args.regions):
+                chrom, start, end = parse_region(region)
+                queries.append((args.name, chrom, start, end, '+'))
+        if args.batch:
+            queries.extend(proc_batch(args.batch))
+        if args.bed:
+            queries.extend(proc_bed(args.bed))
+    except ValueError as error:
+        sys.stderr.write(f"ERROR: Can not parse region '{error}'.\n")
+        sys.exit(1)
+
+    if args.output:
+        sys.stderr.write(f"Writing output to '{args.output}'.\n")
+        outfh = open(args.output, 'w')
+    else:
+        outfh = sys.stdout
+
+    biofx_profile.count('records', len(queries))
+    with IndexedFasta(args.reference, args.cache) as fasta, \
+            biofx_profile.span('getseq.fetch_regions'):
+        for name, seq in get_sequences(fasta, queries, args.pad, args.revcomp):
+            outfh.write(f'>{name}\n{seq}\n')
+        biofx_profile.count('cache_hits', fasta.fetch.cache_info().hits)
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)
@@ -4,11 +4,14 @@
 #
 # 5/12/2022 - D Sims
 ################################################################################
-import sys
 import re
+import argparse
+import biofx_profile
+import biofx_batch
 
 from pprint import pprint as pp # noqa
 
+@biofx_profile.timed()
 def convert(mut): 
     singles = re.findall(r'([A-Z])', mut)
     triples = [aa_convert(x) for x in singles]
@@ -26,15 +29,27 @@ def aa_convert(query):
     mapping = dict(zip(single_letter, three_letter))
     return mapping[query.title()]
 
-def main():
-    hgvs_file = sys.argv[1]
-    with open(hgvs_file) as fh:
-        hgvs_list = [x.rstrip('\n') for x in fh]
-
-    converted = [convert(alt) for alt in hgvs_list]
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Convert a file of HGVSp short annotations (one per line) '
+            'to HGVSp long.'
+    )
+    parser.add_argument(
+        'hgvs_file',
+        metavar='<hgvs_file>',
+        help="File of HGVSp short annotations, one per line. Use '-' to read "
+            "from STDIN."
+    )
+    biofx_profile.add_argument(parser)
+    return parser.parse_args()
 
-    for c in converted:
-        print(c)
+def main():
+    args = get_args()
+    count = 0
+    for alt in biofx_batch.read_batch(args.hgvs_file):
+        print(convert(alt))
+        count += 1
+    biofx_profile.count('records', count)
 
 if __name__ == "__main__":
     main()
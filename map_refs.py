@@ -12,10 +12,13 @@ develop more functionality.
 import sys
 import os
 import argparse
+import biofx_profile
+import biofx_batch
+import biofx_output
 from pyliftover import LiftOver
 from pprint import pprint as pp
 
-version = '0.1.020918'
+version = '0.2.101826'
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
@@ -28,15 +31,17 @@ def get_args():
         'Default: %(default)s.')
     parser.add_argument('-c', '--chain', metavar='<chain_file>', 
         help='Chain file from UCSC for local mapping. Will allow for offline '
-        'results.  ****  NOT YET IMPLEMENTED  ****.')
+        'results.')
     parser.add_argument('-o', '--outfile', metavar='<output_file>',
-        help='File to which to write results. Default STDOUT.')
+        help="File to which to write results. Add '.gz' or '.zst' to compress, "
+        "or use '.parquet' or '.arrow' for columnar output. Default STDOUT.")
     parser.add_argument('-v', '--version', action='version', 
         version = '%(prog)s - v' + version)
+    biofx_profile.add_argument(parser)
     args = parser.parse_args()
 
     coord_list = []
-    chainfile = None
+    chainfile = args.chain
 
     if not any((args.coord,args.file)):
         sys.stderr.write("ERROR: You must input either a list of coords to check"
@@ -45,38 +50,33 @@ def get_args():
     elif args.coord:
         coord_list = args.coord.split(',')
     else:
-        coord_list = proc_batchfile(args.file)
+        coord_list = biofx_batch.read_batch(args.file)
 
     # Set up proper mapping
     orig_assembly, new_assembly = args.mapping.split(':')
     sys.stderr.write("Mapping from {} to {}.\n".format(orig_assembly, 
         new_assembly))
 
-    #Set up and output filehandle
     if args.outfile:
         sys.stderr.write('Writing output to {}.\n'.format(args.outfile))
-        outfh = open(args.outfile, 'w')
-    else:
-        outfh = sys.stdout
-
-    return coord_list, orig_assembly, new_assembly, chainfile, outfh
 
-def proc_batchfile(batchfile):
-    with open(batchfile) as fh:
-        return [x.rstrip('\n') for x in fh]
+    return coord_list, orig_assembly, new_assembly, chainfile, args.outfile
 
-def print_results(results, outfh):
+def print_results(results, outfile):
     sys.stderr.write('\n')
-    outfh.write(','.join(('OrigChr', 'OrigPos', 'NewChr', 'NewPos')))
-    outfh.write('\n')
-
-    for r in results:
-        outfh.write(','.join(map(str,r[0:4])))
-        outfh.write('\n')
+    columns = ('OrigChr', 'OrigPos', 'NewChr', 'NewPos')
+    with biofx_output.open_writer(outfile, columns, ',') as writer:
+        for r in results:
+            writer.writerow(r[0:4])
 
-def main(coords, orig_assembly, new_assembly, chainfile, outfh):
+@biofx_profile.timed()
+def main(coords, orig_assembly, new_assembly, chainfile, outfile):
     # Create a LiftOver object with desired mapping.
-    lo = LiftOver(orig_assembly, new_assembly)
+    with biofx_profile.span('map_refs.load_chain'):
+        if chainfile:
+            lo = LiftOver(chainfile)
+        else:
+            lo = LiftOver(orig_assembly, new_assembly)
 
     results = []
     for coord in coords:
@@ -92,12 +92,13 @@ def main(coords, orig_assembly, new_assembly, chainfile, outfh):
             sys.stderr.write('Offending coord: %s' % coord)
             raise
 
-    print_results(results, outfh)
+    biofx_profile.count('records', len(results))
+    print_results(results, outfile)
 
 if __name__=='__main__':
-    coord_list, orig_assembly, new_assembly, chainfile, outfh = get_args()
+    coord_list, orig_assembly, new_assembly, chainfile, outfile = get_args()
     try:
-        main(coord_list, orig_assembly, new_assembly, chainfile, outfh)
+        main(coord_list, orig_assembly, new_assembly, chainfile, outfile)
     except KeyboardInterrupt:
         sys.exit(9)
 
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# Search a genome or transcriptome for every place that a set of peptides (or
+# peptide regexes) could be encoded, in all six reading frames.  The peptides
+# go into an Aho-Corasick automaton so that thousands of them can be found in
+# one pass over each translated frame, and the sequence is translated and
+# scanned in overlapping chunks across a process pool.
+################################################################################
+"""
+Find every location in a FASTA file (genome, transcriptome, etc.) where any of
+a set of peptides could be encoded, in all six reading frames. Peptides are
+given in single letter code, one per line in a file ('-f') and / or on the
+command line ('-q'). Anything that is not plain amino acid letters is treated
+as a regular expression (e.g. 'SIINF[EK]KL' or 'K.{2}EL'), which must have a
+bounded length.
+
+Each hit is reported with the 1-based start and end coordinates of the
+encoding sequence on the forward strand, the strand, the frame (the offset of
+the codons from the start of the sequence: 0, 1 or 2), the pattern and the
+matched peptide. Overlapping hits are all reported, for regexes as well as
+plain peptides. Hits spanning an 'N' (or other non-ACGT base) are not found,
+even by a regex with '.' or a negated character class.
+
+Uses pyahocorasick if it is installed, and a pure Python automaton if not.
+Requires NumPy.
+"""
+import sys
+import re
+import argparse
+import biofx_profile
+import biofx_batch
+import biofx_output
+import codon_aa_converter
+
+from collections import deque
+from pprint import pprint as pp # noqa
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+version = '1.0.101826'
+
+columns = ['seqname', 'start', 'end', 'strand', 'frame', 'pattern', 'peptide']
+max_pattern_length = 1000
+peptide_re = re.compile(r'^[ACDEFGHIKLMNPQRSTVWY*]+$')
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'fasta',
+        metavar='<fasta>',
+        help="FASTA file to search (gzip OK), or '-' for STDIN."
+    )
+    parser.add_argument(
+        '-f', '--file',
+        metavar='<peptide_file>',
+        help='File of peptides or peptide regexes to search for, one per line.'
+    )
+    parser.add_argument(
+        '-q', '--query',
+        metavar='<peptide>',
+        action='append',
+        help='Peptide or peptide regex to search for. Can be used more than '
+            'once.'
+    )
+    parser.add_argument(
+        '-p', '--procs',
+        type=int,
+        metavar='INT',
+        default=4,
+        help='Number of processes to use. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-c', '--chunk-size',
+        type=int,
+        metavar='INT',
+        default=3000000,
+        help='Size (in bases) of the chunks that each sequence is split into '
+            'for the workers. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<output_file>',
+        help="Output file. Add '.gz' or '.zst' to compress, or use '.parquet' "
+            "or '.arrow' for columnar output. Default: STDOUT."
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version='%(prog)s - v' + version
+    )
+    biofx_profile.add_argument(parser)
+    args = parser.parse_args()
+
+    patterns = list(args.query or [])
+    if args.file:
+        patterns.extend(biofx_batch.read_batch(args.file))
+    if not patterns:
+        sys.stderr.write('ERROR: No peptides to search for. Use -f and / or '
+            '-q.\n')
+        sys.exit(1)
+    # Drop duplicates, keeping the first one seen. Only the plain peptides are
+    # upper cased, since that would change the meaning of some regexes.
+    args.patterns = list(dict.fromkeys(p.upper() if peptide_re.match(p.upper())
+        else p for p in patterns))
+    # Keep the chunks in frame with the start of the sequence.
+    args.chunk_size -= args.chunk_size % 3
+    if args.chunk_size < 3:
+        sys.stderr.write('ERROR: Chunk size must be at least 3.\n')
+        sys.exit(1)
+    return args
+
+class Automaton():
+    """
+    Pure Python Aho-Corasick automaton, with the same interface as the parts
+    of pyahocorasick's Automaton that we use. The failure links are folded
+    into a full transition table, so that each character is a single lookup.
+    """
+    alphabet = 'ACDEFGHIKLMNPQRSTVWXY*'
+
+    def __init__(self):
+        self.goto = [{}]
+        self.values = [[]]
+
+    def add_word(self, word, value):
+        state = 0
+        for char in word:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.values.append([])
+            state = nxt
+        self.values[state].append(value)
+
+    def make_automaton(self):
+        # Breadth first through the trie, setting up each state's full row of
+        # transitions from its failure state's row.
+        k = len(self.alphabet) + 1
+        n = len(self.goto)
+        delta = [0] * (n * k)
+        fail = [0] * n
+        queue = deque()
+        for c, char in enumerate(self.alphabet):
+            nxt = self.goto[0].get(char)
+            if nxt:
+                delta[c] = nxt * k
+                queue.append(nxt)
+
+        while queue:
+            state = queue.popleft()
+            base = state * k
+            fail_base = fail[state] * k
+            self.values[state] = self.values[state] + self.values[fail[state]]
+            for c, char in enumerate(self.alphabet):
+                nxt = self.goto[state].get(char)
+                if nxt:
+                    fail[nxt] = delta[fail_base + c] // k
+                    delta[base + c] = nxt * k
+                    queue.append(nxt)
+                else:
+                    delta[base + c] = delta[fail_base + c]
+
+        # Characters outside the alphabet (column k - 1) go back to the root.
+        self.delta = delta
+        self.outputs = [None] * (n * k)
+        for state, values in enumerate(self.values):
+            if values:
+                self.outputs[state * k] = values
+        self.table = bytes(self.alphabet.index(chr(i)) if chr(i) in
+            self.alphabet else len(self.alphabet) for i in range(256))
+        del self.goto, self.values
+
+    def iter(self, text):
+        """
+        Generator of (end_index, value) for every word found in `text`, where
+        `end_index` is the index of the word's last character.
+        """
+        delta, outputs = self.delta, self.outputs
+        state = 0
+        for i, c in enumerate(text.encode().translate(self.table)):
+            state = delta[state + c]
+            if outputs[state]:
+                for value in outputs[state]:
+                    yield i, value
+
+def make_automaton():
+    try:
+        import ahocorasick
+        return ahocorasick.Automaton()
+    except ImportError:
+        return Automaton()
+
+def _anchor(parsed):
+    # Longest run of literal residues that every match of a parsed regex has
+    # to contain, or '' if there isn't one.
+    best = run = ''
+    for op, arg in parsed:
+        op = str(op)
+        if op == 'LITERAL':
+            run += chr(arg)
+            continue
+        if op in ('MAX_REPEAT', 'MIN_REPEAT'):
+            low, high, sub = arg
+            sub = list(sub)
+            if low >= 1 and len(sub) == 1 and str(sub[0][0]) == 'LITERAL':
+                run += chr(sub[0][1])
+        best = max(best, run, key=len)
+        run = ''
+    return max(best, run, key=len)
+
+class Searcher():
+    """
+    Peptide search over translated sequence. Plain peptides go straight into
+    the automaton. Each regex goes in by its longest required literal run,
+    and is only run around the hits of that run; regexes without one are run
+    over the whole sequence.
+    """
+    def __init__(self, patterns):
+        self.automaton = make_automaton()
+        self.regexes = []
+        self.unanchored = []
+        self.max_length = 0
+
+        words = {}
+        for pattern in patterns:
+            if peptide_re.match(pattern):
+                words.setdefault(pattern, []).append((pattern, None))
+                self.max_length = max(self.max_length, len(pattern))
+                continue
+
+            regex = re.compile(pattern)
+            parsed = sre_parse.parse(pattern)
+            low, high = parsed.getwidth()
+            if low == 0:
+                raise ValueError(f"Pattern '{pattern}' can match an empty "
+                    "peptide.")
+            if high > max_pattern_length:
+                raise ValueError(f"Pattern '{pattern}' can match more than "
+                    f"{max_pattern_length} residues.")
+            self.max_length = max(self.max_length, high)
+            anchor = _anchor(parsed)
+            if anchor:
+                words.setdefault(anchor, []).append((pattern, (regex, high)))
+            else:
+                self.unanchored.append((pattern, regex))
+
+        for word, values in words.items():
+            self.automaton.add_word(word, (word, values))
+        if words:
+            self.automaton.make_automaton()
+        self.has_words = bool(words)
+
+    def search(self, peptide):
+        """
+        Return (start, end, pattern, match) for each hit in a translated
+        sequence, with 0-based, half open positions.
+        """
+        hits = set()
+        windows = {}
+        if self.has_words:
+            for end, (word, values) in self.automaton.iter(peptide):
+                start = end - len(word) + 1
+                for pattern, regex in values:
+                    if regex is None:
+                        hits.add((start, end + 1, pattern, word))
+                    else:
+                        windows.setdefault(pattern, (regex[0], []))[1].append(
+                            (max(0, start - regex[1]), end + 1 + regex[1]))
+
+        for pattern, (regex, spans) in windows.items():
+            for lo, hi in _merge(spans):
+                for match in _regex_hits(regex, peptide, lo, hi):
+                    hits.add((match.start(), match.end(), pattern,
+                        match.group()))
+
+        for pattern, regex in self.unanchored:
+            for match in _regex_hits(regex, peptide, 0, len(peptide)):
+                hits.add((match.start(), match.end(), pattern, match.group()))
+        return sorted(hits)
+
+def _regex_hits(regex, peptide, lo, hi):
+    # Generator of the match at every start position in [lo, hi) that has one,
+    # so that overlapping matches are found just like the literal peptides
+    # are. Matches over an X (a codon with an N) are dropped.
+    pos = lo
+    while pos < hi:
+        match = regex.search(peptide, pos, hi)
+        if match is None:
+            return
+        if 'X' not in match.group():
+            yield match
+        pos = match.start() + 1
+
+def _merge(spans):
+    merged = []
+    for lo, hi in sorted(spans):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+def _translation_tables():
+    # Codon index to amino acid for the forward and reverse strands, with 'X'
+    # for codons with a non-ACGT base.
+    import numpy as np
+
+    forward = np.frombuffer((codon_aa_converter.amino_acids + 'X').encode(),
+        dtype=np.uint8)
+    complement = 'AGTC'
+    rc_idx = [codon_aa_converter.codons.index(''.join(complement['TCAG'.index(
+        b)] for b in reversed(codon))) for codon in codon_aa_converter.codons]
+    reverse = forward[rc_idx + [64]]
+    return forward, reverse
+
+def six_frames(seq, lut, tables):
+    """
+    Generator of (strand, frame, peptide) for each of the six frames of a
+    sequence. Frames are the offset of the codons from the start of `seq`.
+    The reverse strand peptides read right to left along `seq`, as usual.
+    """
+    import numpy as np
+
+    forward, reverse = tables
+    bases = lut[np.frombuffer(seq.encode(), dtype=np.uint8)]
+    for frame in range(3):
+        codons = bases[frame:]
+        codons = codons[:len(codons) - len(codons) % 3].reshape(-1, 3)
+        idx = (codons[:, 0].astype(np.uint16) * 16 + codons[:, 1] * 4 +
+            codons[:, 2])
+        idx[(codons == 4).any(axis=1)] = 64
+        yield '+', frame, forward[idx].tobytes().decode()
+        yield '-', frame, reverse[idx][::-1].tobytes().decode()
+
+_searcher = None
+
+def _init_worker(patterns):
+    global _searcher, _lut, _tables
+    _searcher = Searcher(patterns)
+    _lut = codon_aa_converter._codon_lookup()
+    _tables = _translation_tables()
+
+def _search_chunk(chunk):
+    # Search one (name, offset, seq, owned) chunk of a sequence, starting at
+    # (0-based) `offset`, and keep the hits that start in the first `owned`
+    # bases; the rest of the chunk is overlap with the next one, which will
+    # report those.
+    name, offset, seq, owned = chunk
+    rows = []
+    for strand, frame, peptide in six_frames(seq, _lut, _tables):
+        n = len(peptide)
+        for start, end, pattern, match in _searcher.search(peptide):
+            if strand == '-':
+                start, end = n - end, n - start
+            nt_start = frame + start * 3
+            if nt_start >= owned:
+                continue
+            rows.append((name, offset + nt_start + 1, offset + frame + end * 3,
+                strand, frame, pattern, match))
+    rows.sort(key=lambda r: (r[1], r[3], r[5]))
+    return len(seq), rows
+
+def fasta_chunks(fasta, chunk_size, overlap):
+    """
+    Generator that streams a FASTA file and yields (name, offset, seq, owned)
+    for chunks of each sequence. Each chunk owns `chunk_size` bases, and runs
+    on `overlap` bases into the next one.
+    """
+    name = None
+    buf = []
+    buf_len = 0
+    offset = 0
+
+    def emit(final):
+        # The last chunk of a sequence owns whatever is left.
+        nonlocal buf, buf_len, offset
+        seq = ''.join(buf)
+        while True:
+            if len(seq) > chunk_size + overlap:
+                owned = chunk_size
+            elif final and seq:
+                owned = len(seq)
+            else:
+                break
+            yield name, offset, seq[:chunk_size + overlap], owned
+            seq = seq[owned:]
+            offset += owned
+        buf = [seq]
+        buf_len = len(seq)
+
+    with biofx_batch.open_input(fasta) as fh:
+        for line in fh:
+            if line.startswith('>'):
+                if name is not None:
+                    yield from emit(True)
+                name = line[1:].split()[0]
+                buf, buf_len, offset = [], 0, 0
+                continue
+            line = line.strip()
+            buf.append(line)
+            buf_len += len(line)
+            if buf_len > chunk_size + overlap:
+                yield from emit(False)
+        if name is not None:
+            yield from emit(True)
+
+def search(fasta, patterns, procs=4, chunk_size=3000000):
+    """
+    Generator of (bases, rows) for each chunk of the FASTA file, with the rows
+    in the same order as the file, splitting the chunks across `procs`
+    processes.
+    """
+    overlap = Searcher(patterns).max_length * 3 + 2
+    chunks = fasta_chunks(fasta, chunk_size, overlap)
+    return biofx_batch.pool_map(_search_chunk, chunks, procs, _init_worker,
+        (patterns,))
+
+def main(args):
+    codon_aa_converter.require_numpy('peptide_search.py')
+
+    try:
+        Searcher(args.patterns)
+    except (ValueError, re.error) as error:
+        sys.stderr.write(f'ERROR: {error}\n')
+        sys.exit(1)
+
+    if args.output:
+        sys.stderr.write(f"Writing output to '{args.output}'.\n")
+    total = 0
+    with biofx_output.open_writer(args.output, columns) as writer:
+        for bases, rows in search(args.fasta, args.patterns, args.procs,
+                args.chunk_size):
+            writer.writerows(rows)
+            biofx_profile.count('bases', bases)
+            total += len(rows)
+    biofx_profile.count('hits', total)
+    sys.stderr.write(f'Found {total} hits for {len(args.patterns)} '
+        'patterns.\n')
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)
@@ -3,121 +3,365 @@
 """
 Protein Domain Retrieval Script
 Starting with a correctly formatted HUGO gene ID, retrieve protein domain position
-information from EMBL in a JSON format that can be used as a lookup DB in other 
+information from EMBL in a JSON format that can be used as a lookup DB in other
 programs. You can either load a comma separated string of IDs, or a batchfile
 containing a list of IDs, one per line, to look up.
 
-??Can also output the data as a simple table??
+Once a database is built, use the 'query' command to annotate protein positions
+(either as 'GENE:600' or as HGVSp strings like 'BRAF:p.V600E') with the domains
+in which they fall.
 """
 import sys
 import os
+import re
 import argparse
 import requests
 import json
+import time
+import threading
+import biofx_profile
+import biofx_batch
 
-from pprint import pprint as pp
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pprint import pprint as pp # noqa
 
-version = '0.2.121517'
+version = '0.3.101826'
+
+ebi_url = os.environ.get('BIOFX_EBI_URL',
+    'https://www.ebi.ac.uk/proteins/api/features')
+default_db = 'protein_domain_mapping.json'
+db_format = 1
 
 def get_args():
     parser = argparse.ArgumentParser(description = __doc__)
-    parser.add_argument('build_db', 
-        help='Build a protein mapping database from EMBL for future annotation.'
-            'Will output to a JSON file containing the date.')
-    parser.add_argument('-g', '--gene', metavar='<gene1,gene2,gene3...>', 
+    parser.add_argument('-v', '--version', action='version',
+        version = '%(prog)s - ' + version )
+    subparsers = parser.add_subparsers(dest='command', metavar='<command>')
+
+    build = subparsers.add_parser('build', help='Build a protein mapping '
+        'database from EMBL for future annotation.')
+    build.add_argument('-g', '--gene', metavar='<gene1,gene2,gene3...>',
         help='Comma separated list of gene(s) to look up.')
-    parser.add_argument('-f', '--file', metavar='<batchfile>', 
+    build.add_argument('-f', '--file', metavar='<batchfile>',
         help='Batchfile of genes, one per line, to look up.')
-    parser.add_argument('-o', '--outfile', metavar='<outfile>', 
+    build.add_argument('-t', '--threads', metavar='<int>', type=int, default=8,
+        help='Number of concurrent requests to make. Default: %(default)s.')
+    build.add_argument('-r', '--rate', metavar='<float>', type=float,
+        default=10.0, help='Maximum number of requests per second to send to '
+        'the EBI server. Default: %(default)s.')
+    build.add_argument('-o', '--outfile', metavar='<outfile>',
+        default=default_db, help='Database file to write. Default: '
+        '%(default)s.')
+
+    query = subparsers.add_parser('query', help='Annotate protein positions '
+        'with the domains in which they fall using a previously built '
+        'database.')
+    query.add_argument('positions', nargs='?', metavar='<gene:pos,...>',
+        help='Comma separated list of positions to annotate, in the form of '
+        "'BRAF:600' or 'BRAF:p.V600E'.")
+    query.add_argument('-f', '--file', metavar='<batchfile>',
+        help='Batchfile of positions, one per line, to annotate. Lines can be '
+        'either "gene:pos" or tab delimited "gene<tab>HGVSp".')
+    query.add_argument('-d', '--db', metavar='<db_file>', default=default_db,
+        help='Protein domain database built with the "build" command. '
+        'Default: %(default)s.')
+    query.add_argument('-o', '--outfile', metavar='<outfile>',
         help='Write output to file. DEFAULT: STDOUT.')
-    parser.add_argument('-v', '--version', action='version', 
-        version = '%(prog)s - ' + version )
+    for subparser in (build, query):
+        biofx_profile.add_argument(subparser)
     args = parser.parse_args()
 
-    gene_list = []
-    if args.gene:
-        gene_list = args.gene.split(',')
-    elif args.file:
-        gene_list = proc_batchfile(args.file)
-    else:
-        sys.stderr.write("ERROR: You must input a list of genes to look up or "
-            "a batchfile of genes to look up.\n")
+    if args.command is None:
+        parser.print_help()
         sys.exit(1)
 
-    if args.outfile:
-        outfh = open(outfile, "w")
+    if args.command == 'build':
+        if args.gene:
+            args.queries = args.gene.split(',')
+        elif args.file:
+            args.queries = list(biofx_batch.read_batch(args.file,
+                dedupe=True))
+        else:
+            sys.stderr.write("ERROR: You must input a list of genes to look up "
+                "or a batchfile of genes to look up.\n")
+            sys.exit(1)
     else:
-        outfh = sys.stdout
-
-    return gene_list, outfh
+        if args.positions:
+            args.queries = args.positions.split(',')
+        elif args.file:
+            args.queries = biofx_batch.read_batch(args.file)
+        else:
+            sys.stderr.write("ERROR: You must input a list of positions or a "
+                "batchfile of positions to annotate.\n")
+            sys.exit(1)
 
-def proc_batchfile(batchfile):
-    with open(batchfile) as fh:
-        return [line.rstrip('\n') for line in fh]
+    return args
 
-def map_uniprot(gene):
+def map_uniprot(gene_list):
     """
     We will get a lot of results if we don't use a specific uniprot accession
     number.  But, juggling that is hard. So, let's have user input normal UCSC
-    gene ID, but then map it to uniprot ID before we retrieve results.
+    gene ID, but then map it to uniprot ID before we retrieve results.  If we
+    don't have the mapping file, or the gene is not in it, we'll fall back to
+    a gene name query limited to reviewed human entries.
     """
     gene_map = {}
     uniprot_db_file = os.path.join(
         os.path.dirname(os.path.realpath(__file__)),
         'resources/gene_transcript_uniprot_kegg_map.csv'
     )
-    try:
-        with open(uniprot_db_file) as fh:
-            for line in fh:
-                elems = line.split(',')
+    if not os.path.exists(uniprot_db_file):
+        return gene_map
+
+    wanted = set(gene_list)
+    with open(uniprot_db_file) as fh:
+        for line in fh:
+            elems = line.rstrip('\n').split(',')
+            if elems[0] in wanted and len(elems) > 2 and elems[2]:
                 gene_map[elems[0]] = elems[2]
-    except:
-        raise
     return gene_map
-            
-def api_call(url, query):
+
+class RateLimiter():
+    """
+    Simple thread safe limiter that spaces out calls so that we never send
+    more than `rate` requests per second to the server, no matter how many
+    worker threads are running.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def make_session(pool_size):
+    """
+    Set up one pooled session to share across all threads so that we can
+    reuse connections, and retry with backoff if the server tells us to slow
+    down.
+    """
+    retries = Retry(total=5, backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+        max_retries=retries)
     session = requests.Session()
-    request = session.get(url, params=query)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept' : 'application/json'})
+    return session
+
+@biofx_profile.timed()
+def api_call(session, url, query, limiter=None):
+    if limiter:
+        with biofx_profile.span('protein_domain_retrieve.rate_limit_wait'):
+            limiter.wait()
+    biofx_profile.count('requests')
+    request = session.get(url, params=query, timeout=30)
+    request.raise_for_status()
+    return request.json()
+
+def _parse_pos(pos):
+    # EBI will give us fuzzy positions like '<1' or '~' sometimes.
     try:
-        request.raise_for_status()
-    except requests.exceptions.HTTPError as error:
-        sys.stderr.write(error)
-        sys.exit(1)
+        return int(str(pos).lstrip('<>~'))
+    except ValueError:
+        return None
+
+def proc_features(entry):
+    """
+    Convert an EBI features entry into a compact record of the accession,
+    protein length, and a list of [start, end, type, description] features
+    sorted by start position.
+    """
+    features = []
+    for feat in entry.get('features', []):
+        start = _parse_pos(feat.get('begin'))
+        end = _parse_pos(feat.get('end'))
+        if start is None or end is None:
+            continue
+        features.append([start, end, feat.get('type', '-'),
+            feat.get('description', '')])
+    features.sort()
+    return {
+        'accession' : entry.get('accession'),
+        'length'    : len(entry.get('sequence', '')),
+        'features'  : features,
+    }
+
+def fetch_gene(session, limiter, gene, accession=None):
+    if accession:
+        data = api_call(session, '%s/%s' % (ebi_url, accession),
+            {'categories' : 'DOMAINS_AND_SITES'}, limiter)
+        return proc_features(data)
 
-    json_data = request.json()
-    return json_data
-    
-def main(gene_list, outfh):
+    data = api_call(session, ebi_url, {
+        'gene'       : gene,
+        'exact_gene' : 'true',
+        'organism'   : 'human',
+        'reviewed'   : 'true',
+        'categories' : 'DOMAINS_AND_SITES',
+    }, limiter)
+    if not data:
+        return None
+    # Only want the canonical entry; if there are a few, take the longest.
+    return proc_features(max(data, key=lambda x: len(x.get('sequence', ''))))
+
+@biofx_profile.timed()
+def build_db(gene_list, outfile, threads, rate):
     mapped_genes = map_uniprot(gene_list)
+    session = make_session(threads)
+    limiter = RateLimiter(rate)
     results = {}
 
-    for gene in gene_list:
-        try:
-            method = mapped_genes[gene]
-        except KeyError:
-            sys.stderr.write("WARN: Can not find entry for %s in the database "
-                "file. Skipping.\n" % gene)
-        url = 'https://www.ebi.ac.uk/proteins/api/features/' + method
-        query = {
-            'categories' : 'DOMAINS_AND_SITES',
+    sys.stderr.write('Retrieving domain data for %i genes...\n' %
+        len(gene_list))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        jobs = {
+            executor.submit(fetch_gene, session, limiter, gene,
+                mapped_genes.get(gene)) : gene for gene in set(gene_list)
         }
-        pp(api_call(url, query))
-        #results[gene] = api_call(url, query)
+        for job in as_completed(jobs):
+            gene = jobs[job]
+            try:
+                record = job.result()
+            except requests.exceptions.RequestException as error:
+                sys.stderr.write("WARN: Can not retrieve data for %s (%s). "
+                    "Skipping.\n" % (gene, error))
+                continue
+            if record is None:
+                sys.stderr.write("WARN: Can not find entry for %s in the "
+                    "database. Skipping.\n" % gene)
+                continue
+            results[gene] = record
 
-    outfile = 'protein_domain_mapping.json'
-    sys.stdout.write('Writing results to %s...\n' % outfile)
-    sys.stdout.flush()
+    sys.stderr.write('Writing results to %s...\n' % outfile)
     with open(outfile, 'w') as outfh:
-        json.dump(results, outfh, indent=4)
-    sys.stdout.write('Done!\n')
+        json.dump({
+            'file_info' : {
+                'format'  : db_format,
+                'version' : version,
+                'date'    : time.strftime('%Y.%m.%d'),
+            },
+            'genes' : dict(sorted(results.items())),
+        }, outfh, separators=(',', ':'))
+    sys.stderr.write('Done!\n')
+    return results
+
+@biofx_profile.timed()
+def load_db(db_file):
+    """
+    Load the domain database and build an interval index for each protein.
+    The index is the sorted feature starts, along with a running max of the
+    feature ends, so that we can bisect to the last feature starting at or
+    before a position, and walk back only until no earlier feature can reach
+    the position.
+    """
+    with open(db_file) as fh:
+        data = json.load(fh)
 
+    index = {}
+    for gene, record in data['genes'].items():
+        features = record['features']
+        starts = [f[0] for f in features]
+        max_ends = []
+        running = 0
+        for f in features:
+            running = max(running, f[1])
+            max_ends.append(running)
+        index[gene] = (starts, max_ends, features)
+    return index
 
-if __name__ == '__main__':
-    gene_list, outfh = get_args()
+def find_domains(index, gene, pos):
+    """
+    Return a list of features from the database that overlap the protein
+    position `pos` of `gene`.
+    """
+    try:
+        starts, max_ends, features = index[gene]
+    except KeyError:
+        return None
+
+    hits = []
+    i = bisect_right(starts, pos) - 1
+    while i >= 0 and max_ends[i] >= pos:
+        if features[i][1] >= pos:
+            hits.append(features[i])
+        i -= 1
+    hits.reverse()
+    return hits
+
+def parse_position(query):
+    """
+    Split up a query string into gene and protein position. Accept
+    'GENE:600', 'GENE:p.V600E', 'GENE:p.Val600Glu', or the same with a tab
+    in place of the colon.
+    """
+    gene, _, var = re.split(r'([:\t])', query.strip(), maxsplit=1)
+    match = re.match(r'(?:p\.)?\(?(?:[A-Z](?:[a-z]{2})?|\*)?(\d+)', var)
+    if match is None:
+        return gene, var, None
+    return gene, var, int(match.group(1))
+
+@biofx_profile.timed()
+def annotate(index, queries):
+    """
+    Bulk annotate a list of queries, returning tuples of (gene, variant,
+    position, features).
+    """
+    results = []
+    for query in queries:
+        try:
+            gene, var, pos = parse_position(query)
+        except ValueError:
+            sys.stderr.write("WARN: Can not parse query '%s'. Skipping.\n" %
+                query)
+            continue
+        hits = find_domains(index, gene, pos) if pos is not None else None
+        results.append((gene, var, pos, hits))
+    biofx_profile.count('records', len(results))
+    return results
+
+def print_results(results, outfh):
+    outfh.write('\t'.join(('Gene', 'Query', 'Position', 'Domains')))
+    outfh.write('\n')
+    for gene, var, pos, hits in results:
+        if hits is None:
+            domains = '---'
+        elif not hits:
+            domains = '-'
+        else:
+            domains = ';'.join('%s:%s(%i-%i)' % (f[2], f[3] or '-', f[0], f[1])
+                for f in hits)
+        outfh.write('\t'.join((gene, var, str(pos) if pos else '-', domains)))
+        outfh.write('\n')
 
-    # TODO
-    sys.stderr.write('This script is not yet implemented as it is still a work'
-        ' in progress.\n')
-    sys.exit(1)
+def main(args):
+    if args.command == 'build':
+        build_db(args.queries, args.outfile, args.threads, args.rate)
+        return
 
-    main(gene_list, outfh)
+    index = load_db(args.db)
+    results = annotate(index, [q for q in args.queries if q])
+    if args.outfile:
+        sys.stderr.write('Writing results to %s...\n' % args.outfile)
+        with open(args.outfile, 'w') as outfh:
+            print_results(results, outfh)
+    else:
+        print_results(results, sys.stdout)
+
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# Generate a saturation mutagenesis table for a set of coding sequences: every
+# possible SNV, with its codon change, HGVSp (short and long) and consequence.
+# Rather than translating each mutant codon, the outcome of all 9 possible SNVs
+# of each of the 64 codons is worked out once, and then looked up for whole
+# CDS arrays at a time.
+################################################################################
+"""
+Output every possible SNV in each coding sequence of a FASTA file, along with
+the codon change, the protein change as HGVSp short (p.V600E) and long
+(p.Val600Glu), and the consequence: synonymous, missense, nonsense, stoploss,
+or startloss for a change to the initiating Met. The consequences agree with
+get_clinvar_variant_data.py (a long HGVSp ending in 'Ter' is nonsense).
+
+Positions are relative to the start of each sequence, so the FASTA should have
+the CDS only (e.g. from gffread or the Ensembl / GENCODE CDS sets). Codons with
+bases other than A, C, G or T, and any trailing partial codon, are skipped.
+Requires NumPy.
+"""
+import sys
+import argparse
+import biofx_profile
+import biofx_batch
+import biofx_output
+import codon_aa_converter
+
+from functools import partial
+from pprint import pprint as pp # noqa
+
+version = '1.0.101826'
+
+columns = ['transcript', 'hgvsc', 'codon_change', 'aa_pos', 'hgvsp_short',
+    'hgvsp_long', 'consequence']
+consequences = ['synonymous', 'missense', 'nonsense', 'stoploss', 'startloss']
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'fasta',
+        metavar='<cds_fasta>',
+        help="FASTA file of coding sequences (gzip OK), or '-' for STDIN."
+    )
+    parser.add_argument(
+        '-p', '--procs',
+        type=int,
+        metavar='INT',
+        default=4,
+        help='Number of processes to use. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-c', '--consequence',
+        metavar='<class1,class2,...>',
+        help='Only output SNVs with these consequences (from '
+            f"{','.join(consequences)})."
+    )
+    parser.add_argument(
+        '-o', '--output',
+        metavar='<output_file>',
+        help="Output file. Add '.gz' or '.zst' to compress, or use '.parquet' "
+            "or '.arrow' for columnar output. Default: STDOUT."
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version='%(prog)s - v' + version
+    )
+    biofx_profile.add_argument(parser)
+    args = parser.parse_args()
+
+    if args.consequence:
+        args.consequence = args.consequence.split(',')
+        unknown = set(args.consequence) - set(consequences)
+        if unknown:
+            sys.stderr.write(f"ERROR: Unknown consequence(s): "
+                f"{','.join(unknown)}.\n")
+            sys.exit(1)
+    return args
+
+def build_outcome_table():
+    """
+    Work out the outcome of each of the 9 SNVs (3 positions x 3 alternate
+    bases) of each of the 64 codons, in `codon_aa_converter.codons` order.
+    Returns a 64 x 9 array of consequence indices, and a matching list of
+    lists of (ref_base, alt_base, codon_change, ref_aa, alt_aa) tuples. The
+    consequence assumes the codon is not the initiating Met; that case is
+    handled by `Mutator`.
+    """
+    import numpy as np
+
+    table = np.zeros((64, 9), dtype=np.uint8)
+    details = []
+    for i, codon in enumerate(codon_aa_converter.codons):
+        ref_aa = codon_aa_converter.codon_table[codon]
+        row = []
+        for j in range(9):
+            pos, k = divmod(j, 3)
+            alt_base = [b for b in 'ACGT' if b != codon[pos]][k]
+            alt = codon[:pos] + alt_base + codon[pos + 1:]
+            alt_aa = codon_aa_converter.codon_table[alt]
+
+            if alt_aa == ref_aa:
+                table[i, j] = consequences.index('synonymous')
+            elif ref_aa == '*':
+                table[i, j] = consequences.index('stoploss')
+            elif alt_aa == '*':
+                table[i, j] = consequences.index('nonsense')
+            else:
+                table[i, j] = consequences.index('missense')
+            row.append((codon[pos], alt_base, f'{codon}>{alt}', ref_aa, alt_aa))
+        details.append(row)
+    return table, details
+
+def _hgvsp(ref_aa, alt_aa, consequence):
+    # The short and long HGVSp for a change, as (prefix, suffix) pairs to go
+    # around the amino acid position. Uses the same three letter codes as
+    # hgvsp_short2long.py, with Ter for stops.
+    three = codon_aa_converter.single_to_three
+    if consequence == 'synonymous':
+        return (f'p.{ref_aa}', '='), (f'p.{three[ref_aa]}', '=')
+    elif consequence == 'startloss':
+        return (f'p.{ref_aa}', '?'), (f'p.{three[ref_aa]}', '?')
+    elif consequence == 'stoploss':
+        return ('p.*', f'{alt_aa}ext*?'), ('p.Ter', f'{three[alt_aa]}extTer?')
+    return (f'p.{ref_aa}', alt_aa), (f'p.{three[ref_aa]}', three[alt_aa])
+
+class Mutator():
+    """
+    Lookup tables of every codon SNV outcome and the row pieces to go with
+    them, so that a CDS only needs to be encoded and indexed into them. Rows
+    0-63 are the codons, row 64 is for codons with an invalid base (nothing to
+    output), and row 65 is an initiating ATG.
+    """
+    invalid = 64
+    start = 65
+
+    def __init__(self, wanted=None):
+        import numpy as np
+
+        self.np = np
+        self.lut = codon_aa_converter._codon_lookup()
+        table, details = build_outcome_table()
+        startloss = consequences.index('startloss')
+
+        atg = codon_aa_converter.codons.index('ATG')
+        table = np.vstack([table, np.zeros((1, 9), dtype=np.uint8),
+            np.full((1, 9), startloss, dtype=np.uint8)])
+        details = details + [[None] * 9, details[atg]]
+
+        wanted = [consequences.index(c) for c in (wanted or consequences)]
+        self.wanted = np.isin(table, wanted)
+        self.wanted[self.invalid] = False
+
+        # Everything but the positions, for each outcome.
+        self.pieces = []
+        for codon_row, detail_row in zip(table.tolist(), details):
+            pieces = []
+            for c, detail in zip(codon_row, detail_row):
+                if detail is None:
+                    pieces.append(None)
+                    continue
+                ref, alt, change, ref_aa, alt_aa = detail
+                consequence = consequences[c]
+                short, long = _hgvsp(ref_aa, alt_aa, consequence)
+                pieces.append((f'{ref}>{alt}', change, short, long,
+                    consequence))
+            self.pieces.append(pieces)
+        self.templates = {}
+
+    def _lookup(self, seq):
+        # Returns the codon number, SNV number and outcome row of each wanted
+        # SNV in the CDS.
+        idx = codon_aa_converter.encode_cds(seq, self.lut, drop_invalid=False)
+        if len(idx) and idx[0] == codon_aa_converter.codons.index('ATG'):
+            idx[0] = self.start
+        codon_nums, mut_nums = self.np.nonzero(self.wanted[idx])
+        return codon_nums, mut_nums, idx[codon_nums]
+
+    def mutate(self, name, seq):
+        """
+        Return a row for every (wanted) SNV of a CDS.
+        """
+        rows = []
+        pieces = self.pieces
+        for codon_num, j, codon in zip(*(x.tolist() for x in
+                self._lookup(seq))):
+            snv, change, short, long, consequence = pieces[codon][j]
+            aa_pos = codon_num + 1
+            rows.append((name, f'c.{codon_num * 3 + j // 3 + 1}{snv}', change,
+                aa_pos, f'{short[0]}{aa_pos}{short[1]}',
+                f'{long[0]}{aa_pos}{long[1]}', consequence))
+        return rows
+
+    def mutate_text(self, name, seq, delimiter):
+        """
+        Same as `mutate`, but return the rows as delimited text lines, which
+        is much quicker than making the rows and then formatting them.
+        """
+        templates = self.templates.get(delimiter)
+        if templates is None:
+            templates = self.templates[delimiter] = [
+                [None if p is None else (
+                    f'{p[0]}{delimiter}{p[1]}{delimiter}',
+                    f'{delimiter}{p[2][0]}',
+                    f'{p[2][1]}{delimiter}{p[3][0]}',
+                    f'{p[3][1]}{delimiter}{p[4]}\n')
+                for p in row] for row in self.pieces]
+
+        codon_nums, mut_nums, codon_rows = self._lookup(seq)
+        c_pos = (codon_nums * 3 + mut_nums // 3 + 1).tolist()
+        prefix = f'{name}{delimiter}c.'
+        lines = []
+        for cpos, aa_pos, j, codon in zip(c_pos, (codon_nums + 1).tolist(),
+                mut_nums.tolist(), codon_rows.tolist()):
+            a, b, c, d = templates[codon][j]
+            lines.append(f'{prefix}{cpos}{a}{aa_pos}{b}{aa_pos}{c}{aa_pos}{d}')
+        return ''.join(lines)
+
+_mutator = None
+
+def _init_worker(wanted):
+    global _mutator
+    _mutator = Mutator(wanted)
+
+def _mutate_chunk(records, delimiter=None):
+    # Returns the rows for a chunk of records, or if `delimiter` is set, the
+    # rows already formatted as text, which is a lot cheaper to send back to
+    # the main process and write out.
+    if delimiter is None:
+        rows = []
+        for name, seq in records:
+            rows.extend(_mutator.mutate(name, seq))
+        return len(records), len(rows), rows
+    text = ''.join(_mutator.mutate_text(name, seq, delimiter) for name, seq
+        in records)
+    return len(records), text.count('\n'), text
+
+def snv_effects(fasta, wanted=None, procs=4, delimiter=None, chunk_size=50):
+    """
+    Generator that yields the SNV rows for the records of a CDS FASTA, a
+    chunk at a time (see `_mutate_chunk`), splitting the chunks across
+    `procs` processes. Chunks come out in the same order as the records.
+    """
+    chunks = biofx_batch.chunked(codon_aa_converter.read_fasta(fasta),
+        chunk_size)
+    return biofx_batch.pool_map(partial(_mutate_chunk, delimiter=delimiter),
+        chunks, procs, _init_worker, (wanted,))
+
+def main(args):
+    codon_aa_converter.require_numpy('snv_effects.py')
+
+    if args.output:
+        sys.stderr.write(f"Writing output to '{args.output}'.\n")
+    total = 0
+    with biofx_output.open_writer(args.output, columns) as writer:
+        delimiter = None if writer.columnar else writer.delimiter
+        for n, count, rows in snv_effects(args.fasta, args.consequence,
+                args.procs, delimiter):
+            if delimiter is None:
+                writer.writerows(rows)
+            else:
+                writer.write_text(rows)
+            biofx_profile.count('records', n)
+            total += count
+    biofx_profile.count('snvs', total)
+    sys.stderr.write(f'Wrote {total} SNVs.\n')
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)
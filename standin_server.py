@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# Local stand in for the remote services that the network bound tools in this
+# repo depend on (bioDBnet, NCBI eutils, EBI proteins and the UCSC liftOver
+# chain downloads). Recorded responses from resources/standin_responses.json are
+# replayed with configurable latency, errors, and rate limiting, so that we can
+# measure and reproduce performance changes offline.
+################################################################################
+"""
+Start a local HTTP server that replays recorded bioDBnet, NCBI eutils and EBI
+proteins responses, and serves synthetic UCSC liftOver chain files. Point the
+tools at it with:
+
+    BIOFX_BIODBNET_URL=http://127.0.0.1:<port>/webServices/rest.php/biodbnetRestApi.json
+    BIOFX_EUTILS_URL=http://127.0.0.1:<port>/entrez/eutils
+    BIOFX_EBI_URL=http://127.0.0.1:<port>/proteins/api/features
+
+Request statistics can be retrieved from '/_stats' and reset with '/_reset'.
+"""
+import sys
+import os
+import re
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from pprint import pprint as pp # noqa
+
+version = '1.0.101826'
+recordings = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+    'resources', 'standin_responses.json')
+
+# GRCh37 chromosome sizes, used to make synthetic liftOver chains.
+chrom_sizes = {
+    'chr1' : 249250621, 'chr2' : 243199373, 'chr3' : 198022430,
+    'chr4' : 191154276, 'chr5' : 180915260, 'chr6' : 171115067,
+    'chr7' : 159138663, 'chr8' : 146364022, 'chr9' : 141213431,
+    'chr10' : 135534747, 'chr11' : 135006516, 'chr12' : 133851895,
+    'chr13' : 115169878, 'chr14' : 107349540, 'chr15' : 102531392,
+    'chr16' : 90354753, 'chr17' : 81195210, 'chr18' : 78077248,
+    'chr19' : 59128983, 'chr20' : 63025520, 'chr21' : 48129895,
+    'chr22' : 51304566, 'chrX' : 155270560, 'chrY' : 59373566,
+}
+chain_offset = 1000
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__
+    )
+    parser.add_argument(
+        '-p', '--port',
+        type=int,
+        metavar='INT',
+        default=8765,
+        help='Port on which to listen. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-l', '--latency',
+        type=float,
+        metavar='<ms>',
+        default=50.0,
+        help='Base latency to add to each response, in milliseconds. '
+            'Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-j', '--jitter',
+        type=float,
+        metavar='<ms>',
+        default=10.0,
+        help='Random jitter (+/-) to add to the latency, in milliseconds. '
+            'Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-e', '--error-rate',
+        type=float,
+        metavar='<float>',
+        default=0.0,
+        help='Fraction of requests that will get a 500 error. Default: '
+            '%(default)s.'
+    )
+    parser.add_argument(
+        '-r', '--rate-limit',
+        type=float,
+        metavar='<req/s>',
+        default=0,
+        help='Maximum requests per second before sending 429 responses. Use '
+            '0 for no limit. Default: %(default)s.'
+    )
+    parser.add_argument(
+        '-s', '--seed',
+        type=int,
+        metavar='INT',
+        help='Random seed for latency and errors.'
+    )
+    parser.add_argument(
+        '-v', '--version',
+        action='version',
+        version=f'%(prog)s - v{version}'
+    )
+    return parser.parse_args()
+
+def make_chain(from_db, to_db):
+    """
+    Make a gzipped synthetic chain file that maps every chromosome straight
+    across, shifted by `chain_offset` bases.
+    """
+    lines = []
+    for i, (chrom, size) in enumerate(chrom_sizes.items(), start=1):
+        lines.append(f'chain 1000 {chrom} {size} + 0 {size} {chrom} '
+            f'{size + chain_offset} + {chain_offset} {size + chain_offset} {i}')
+        lines.append(f'{size}\n')
+    return gzip.compress('\n'.join(lines).encode())
+
+class StandIn():
+    """
+    Holds the recorded responses, the fault injection settings, and the
+    request stats shared across all of the handler threads.
+    """
+    def __init__(self, latency=50.0, jitter=10.0, error_rate=0.0,
+            rate_limit=0, seed=None, recording_file=recordings):
+        with open(recording_file) as fh:
+            self.recorded = json.load(fh)
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = rate_limit
+        self.last_fill = time.monotonic()
+        self.chains = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests' : 0, 'errors' : 0, 'throttled' : 0,
+                'latencies' : []}
+
+    def record(self, elapsed, status):
+        with self.lock:
+            self.stats['requests'] += 1
+            # Throttled responses go straight back, so keep them out of the
+            # latencies.
+            if status == 429:
+                self.stats['throttled'] += 1
+                return
+            self.stats['latencies'].append(elapsed)
+            if status >= 500:
+                self.stats['errors'] += 1
+
+    def throttled(self):
+        # Token bucket, refilled at `rate_limit` tokens a second.
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit,
+                self.tokens + (now - self.last_fill) * self.rate_limit)
+            self.last_fill = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter,
+                self.jitter)
+            failed = self.random.random() < self.error_rate
+        time.sleep(max(delay, 0))
+        return failed
+
+    def biodbnet(self, params):
+        recorded = self.recorded['biodbnet']
+        template = next(iter(recorded.values()))
+        values = params.get('inputValues', [''])[0].split(',')
+        result = {}
+        for i, value in enumerate(values):
+            outputs = recorded.get(value)
+            if outputs is None:
+                outputs = {k : [f'{v[0]}_{i}'] for k, v in template.items()}
+            result[str(i)] = {'InputValue' : value, 'outputs' : outputs}
+        result['Input'] = params.get('input', [''])[0]
+        result['TaxonId'] = params.get('taxonId', [''])[0]
+        return result
+
+    def esummary(self, params):
+        data = deepcopy(self.recorded['esummary'])
+        uid = params.get('id', [''])[0]
+        template_uid = data['result']['uids'][0]
+        record = data['result'].pop(template_uid)
+        record['uid'] = uid
+        data['result'] = {'uids' : [uid], uid : record}
+        return data
+
+    def elink(self, params):
+        data = deepcopy(self.recorded['elink'])
+        data['linksets'][0]['ids'] = [params.get('id', [''])[0]]
+        return data
+
+    def features(self, path, params):
+        data = deepcopy(self.recorded['features'])
+        accession = path.rstrip('/').split('/')[-1]
+        if accession != 'features':
+            data['accession'] = accession
+            return data
+        # A gene query gets back a list of entries.
+        gene = params.get('gene', [''])[0]
+        data['entryName'] = f'{gene}_HUMAN'
+        return [data]
+
+    def chain(self, path):
+        match = re.search(r'/(\w+)To(\w+)\.over\.chain\.gz$', path)
+        if match is None:
+            return None
+        key = match.groups()
+        if key not in self.chains:
+            self.chains[key] = make_chain(*key)
+        return self.chains[key]
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body, content_type='application/json',
+                headers=None):
+            if isinstance(body, (dict, list)):
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+
+            if url.path == '/_stats':
+                with standin.lock:
+                    return self.send(200, dict(standin.stats))
+            if url.path == '/_reset':
+                standin.reset()
+                return self.send(200, {})
+
+            start = time.monotonic()
+            status = self.route(url.path, params)
+            standin.record(time.monotonic() - start, status)
+
+        def route(self, path, params):
+            if standin.throttled():
+                self.send(429, {'error' : 'Too Many Requests'},
+                    headers={'Retry-After' : '1'})
+                return 429
+            if standin.delay():
+                self.send(500, {'error' : 'Internal Server Error'})
+                return 500
+
+            if path.endswith('biodbnetRestApi.json'):
+                body = standin.biodbnet(params)
+            elif path.endswith('esummary.fcgi'):
+                body = standin.esummary(params)
+            elif path.endswith('elink.fcgi'):
+                body = standin.elink(params)
+            elif '/proteins/api/features' in path:
+                body = standin.features(path, params)
+            elif path.endswith('.over.chain.gz'):
+                body = standin.chain(path)
+                if body is not None:
+                    self.send(200, body, 'application/gzip')
+                    return 200
+            else:
+                body = None
+
+            if body is None:
+                self.send(404, {'error' : f'No recorded response for {path}'})
+                return 404
+            self.send(200, body)
+            return 200
+
+    return Handler
+
+def start_server(port=0, **kwargs):
+    """
+    Start a stand in server on a background thread, and return the server. The
+    actual port is in `server.server_address[1]`.
+    """
+    standin = StandIn(**kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(standin))
+    server.daemon_threads = True
+    server.standin = standin
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(args):
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(
+        StandIn(args.latency, args.jitter, args.error_rate, args.rate_limit,
+            args.seed)))
+    server.daemon_threads = True
+    sys.stderr.write(f'Stand in server listening on http://127.0.0.1:'
+        f'{args.port}\n')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    args = get_args()
+    try:
+        main(args)
+    except KeyboardInterrupt:
+        sys.exit(9)